@@ -1,11 +1,13 @@
-import glob
-import shutil
-from tqdm import tqdm
+import os
 
-username = "tomyt"
+from profile_dirs import ProfileDirs
 
-try:
-    for f in tqdm(glob.glob(f"C:/Users/{username}/AppData/Local/Temp/scoped_dir*")):
-        shutil.rmtree(f)
-except Exception as e:
-        print(e)
\ No newline at end of file
+# same root as the scrapers, None for the default (/dev/shm or the temp folder)
+profile_root = None
+
+# profiles of running scrapers are kept, on windows they can't be told apart from leftovers so only old ones are removed
+max_age = None if os.name == "posix" else 24 * 3600
+
+profile_dirs = ProfileDirs(profile_root)
+removed = profile_dirs.sweep(max_age)
+print(f"removed {removed} chrome profiles from {profile_dirs.root}")
@@ -1,20 +1,27 @@
-import pandas as pd
+from url_registry import UrlRegistry
+from url_source import iter_unique_urls
+from results_store import read_results
+
+REGISTRY_PATH = "results/url_registry.sqlite"
 
 # GENERATE FULL PRODUCT URL
-def generate_full_urls():
-    pages = pd.read_csv("Reviews_withURL.csv", usecols=["ProductURL"])["ProductURL"].unique()
-    pages = pd.Series(pages, name="ProductURL")
-    print(pages.shape[0])
-    pages.to_csv("ProductURL.csv", index=False)
+# every url goes to the url registry once, the scrapers take their next batch from it
+# the review dump is streamed and deduplicated chunk by chunk, never loaded at once
+def generate_full_urls(filename="Reviews_withURL.csv", registry_path=REGISTRY_PATH):
+    registry = UrlRegistry(registry_path)
+    added = registry.register(iter_unique_urls(filename))
+    print(f"NEW URLS: {added}")
+    print(registry.counts())
+    registry.close()
 
 # GENERATE ONLY URL WITH MISSING VALUES (MAYBE SKIPPED DUE TO CAPTCHA)
-def generate_missing_urls(full_data_path, target_path):
-    scrap_results = pd.read_csv(full_data_path)
-    pages_missing = scrap_results[scrap_results["ProductTitle"].isna()]["ProductURL"]
-    pages_missing.to_csv(target_path, index=False)
-    print(f"MISSING VALUES: {pages_missing.shape[0]}")
+# results scraped without the registry are imported once, the missing urls are then a query
+def generate_missing_urls(full_data_path, registry_path=REGISTRY_PATH):
+    registry = UrlRegistry(registry_path)
+    registry.import_results(read_results(full_data_path))
+    print(f"MISSING VALUES: {len(registry.next_batch())}")
+    registry.close()
 
 if __name__ == "__main__":
     full_data_path = "results/from_0_to_10000_scrap_results_Tomy.csv"
-    target_path = "ProductURL_missing.csv"
-    generate_missing_urls(full_data_path, target_path)
+    generate_missing_urls(full_data_path)
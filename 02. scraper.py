@@ -8,7 +8,18 @@ import pandas as pd
 
 # scraping
 import asyncio  # concurrent processing
-from arsenic import get_session, browsers, services  # async selenium
+from session_pool import SessionPool  # reusable arsenic sessions
+from http_scraper import HttpFetcher, extract_page_http, parse_product_html  # browserless fast path
+from page_cache import PageCache  # raw html cache
+from extractors import DEFAULT_FIELDS, select_fields, extract_raw, build_result, classify  # field registry
+from scheduler import run_bounded  # bounded concurrency
+from rate_limiter import AdaptiveRateLimiter  # adaptive request rate
+from url_source import iter_urls  # stream urls from csv
+from url_utils import UrlDeduper, canonicalize_url  # one scrape per product
+from url_registry import UrlRegistry  # scraping status of every url
+from journal import ResultJournal  # crash-safe results
+from result_sink import write_parquet, result_schema  # columnar output
+from metrics import METRICS, span, inc  # per-stage timing
 from datetime import datetime
 import os
 import random
@@ -19,13 +30,15 @@ import structlog
 
 # measure computation time
 from tqdm import tqdm
+from timeit import default_timer as timer
 
 
 def set_arsenic_log_level(level=logging.WARNING):
     logger = logging.getLogger("arsenic")
 
-    def logger_factory():
-        return logger
+    def logger_factory(*args):
+        # structlog.get_logger(name) goes to the stdlib logger of that name, ex: "metrics" spans
+        return logging.getLogger(args[0]) if args else logger
 
     structlog.configure(logger_factory=logger_factory)
     logger.setLevel(level)
@@ -51,152 +64,212 @@ def get_user_agent():
     user_agent = f"Mozilla/5.0 ({random.choice([mac_version, win_version, linux_version])}) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{chrome_version}.0.0.0 Safari/537.36"
     return user_agent
 
-async def extract_details(urls, headless, user_agent=False):
-    # iterate through multiple pages
-    results = []
-    for url in tqdm(urls):
-        # configure the web driver
-        service = services.Chromedriver()
-        browser = browsers.Chrome()
-        browser.capabilities = {
-            "goog:chromeOptions": {
-                "args": [
-                    #"--headless",
-                    "--disable-gpu",
-                    "--no-sandbox",
-                    "--disable-dev-shm-usage",
-                    "--disable-extensions",
-                    "--disable-infobars",
-                    "--disable-notifications",
-                    "--disable-logging",
-                    "--mute-audio",
-                ]
-            }
-        }
-
-        if headless:
-            browser.capabilities['goog:chromeOptions']['args'].append("--headless")
-
-        # random user_agent to avoid captcha
-        if user_agent:
-            user_agent_string = random.choice(user_agent_list)
-            # user_agent_string = get_user_agent()
-            browser.capabilities['goog:chromeOptions']['args'].append(f"user-agent={user_agent_string}")
-
-        async with get_session(service, browser) as session:
-            # random delay to avoid captcha
-            # delay = random.randint(0, 3)
-            # await asyncio.sleep(delay)
-
-            # navigate to the web page
-            await session.get(url)
-            # print(url)
-
-            # get the title of the current page
-            document_title = await session.execute_script("return document.title;")
-
-            # skip scraping process if page not found, ex: https://www.amazon.com/dp/B004N5KULM
-            if document_title == "Page Not Found":
-                results.append(
-                    {
-                        "ProductURL": url,
-                        "ProductTitle": document_title,
-                    }
-                )
-                continue
-
-            # extract the text content of the page
-            ## TITLE
-            try:
-                title_el = await session.get_element("#productTitle")
-                title_text = await title_el.get_text()
-            except:
-                title_text = ""
-
-            ## BYLINE INFO
-            try:
-                byline_el = await session.get_element("#bylineInfo")
-                byline_text = await byline_el.get_text()
-            except:
-                byline_text = ""
-
-            ## BRAND
-            try:
-                table_el = await session.get_element("table")
-                table_text = await table_el.get_text()
-                brand_text = table_text.split('Brand ')[1].split('\n')[0]
-            except:
-                brand_text = ""
-
-            ## DESCRIPTION
-            """
-            try:
-                description_el = await session.get_element("#productDescription")
-                description_text = await description_el.get_text()
-            except:
-                # not all product have description
-                description_text = ""
-            """
-
-            ## FIRST IMAGE
-            """
-            try:
-                img_el = await session.get_element("#imgTagWrapperId")
-                img_el_img = await img_el.get_element("img")
-                img_src = await img_el_img.get_attribute("src")
-            except:
-                img_src = ""
-            """
-
-            ## CATEGORIES
-            try:
-                cat_el = await session.get_element(".a-subheader")
-                cat_text = await cat_el.get_text()
-                cat_text_list = cat_text.split("\n")[::2]
-            except:
-                # not all product have categories, ex: https://www.amazon.com/dp/B001EO5TPM
-                cat_text_list = ""
-
-            results.append(
-                {
-                    "ProductURL": url,
-                    "ProductTitle": title_text,
-                    "ProductBylineInfo": byline_text,
-                    "ProductBrandFromTable": brand_text,
-                    # "ProductDesc": description_text,
-                    # "ProductImg": img_src,
-                    "ProductCategories": cat_text_list,
-                }
-            )
+async def extract_page(session, url, cache=None, fields=DEFAULT_FIELDS):
+    # navigate to the web page
+    with span("navigate"):
+        await session.get(url)
+    # print(url)
+
+    # extract the text content of the page in a single round trip
+    with span("extract"):
+        raw = await extract_raw(session, fields)
+
+    # keep the html so the page can be parsed again without the network
+    if cache is not None and not raw["captcha"]:
+        cache.put(url, await session.get_page_source())
+
+    return build_result(url, raw, fields)
+
+
+async def extract_details(urls, journal, headless, user_agent=False, concurrency=1, max_pages_per_session=100, total=None, engine="browser", pool_size=None, cache=None, limiter=None, registry=None, browser_profile="default", fields=DEFAULT_FIELDS):
+    # one browser session per concurrent task, unless the browser is only a fallback
+    # random user_agent to avoid captcha, picked once per browser launch
+    pool = SessionPool(
+        size=pool_size or concurrency,
+        headless=headless,
+        user_agent_list=user_agent_list if user_agent else None,
+        max_pages=max_pages_per_session,
+        profile=browser_profile,
+    )
+
+    # request rate shared by every session, adapts to captcha / not found pages
+    if limiter is None:
+        limiter = AdaptiveRateLimiter()
+
+    # plain http client for the fast path
+    fetcher = HttpFetcher(concurrency, user_agent_list if user_agent else None)
+
+    async def scrape(url):
+        # cached html, no network at all
+        if cache is not None:
+            page_html = cache.get(url)
+            if page_html is not None:
+                result = parse_product_html(url, page_html, fields)
+                if result is not None:
+                    return result
+
+        if engine == "http":
+            await limiter.acquire()
+            start = timer()
+            result = await extract_page_http(fetcher, url, cache, fields)
+            limiter.record(classify(result), timer() - start)
+            if result is not None:
+                return result
+
+        # browser engine, or fallback for pages the http engine can't handle
+        await limiter.acquire()
+        start = timer()
+        try:
+            async with pool.session() as session:
+                result = await extract_page(session, url, cache, fields)
+        except Exception as e:
+            # keep the url so it shows up as missing and can be scraped again
+            print(e)
+            result = {"ProductURL": url}
+        limiter.record(classify(result), timer() - start)
+        return result
+
+    # scrape the pages concurrently, reusing the browsers in the pool
+    # every result goes straight to the journal instead of a list in memory
+    progress = tqdm(total=total)
+
+    def collect(result):
+        inc("pages_total", outcome=classify(result))
+        with span("write"):
+            journal.append(result)
+        if registry is not None:
+            registry.record(result)
+        progress.update()
+        progress.set_postfix(rate=limiter.rate, captcha=limiter.counts["captcha"], refresh=False)
+
+    async with pool, fetcher:
+        await run_bounded(urls, scrape, concurrency, on_result=collect)
+    progress.close()
+
+    print(pd.DataFrame(pool.report()))
+    print(limiter.metrics())
+
+
+def reextract_details(urls, cache, fields=DEFAULT_FIELDS):
+    # re-run the parsing over cached pages only, no browser and no network
+    # urls=None parses every valid page of the cache
+    if urls is None:
+        cached = cache.iter_pages()
+    else:
+        cached = ((url, cache.get(url)) for url in urls)
 
+    results = []
+    for url, page_html in tqdm(cached):
+        if page_html is None:
+            continue
+        result = parse_product_html(url, page_html, fields)
+        if result is not None:
+            results.append(result)
     return results
 
 
-def main(idx_range, headless, user_agent, filename):
+def main(idx_range, headless, user_agent, filename, concurrency=1, max_pages_per_session=100, engine="browser", pool_size=None, cache_folder=None, reextract=False, initial_rate=1.0, max_rate=5.0, output_format="csv", registry_path=None, metrics_port=None, browser_profile="default", fields=DEFAULT_FIELDS):
     # suppress log from arsenic
     set_arsenic_log_level()
 
-    # list of pages to be scraped
-    pages = pd.read_csv(filename)["ProductURL"].to_list()
-    if "missing" not in filename:
-        pages = pages[idx_range[0] : idx_range[1]]
-
-    results = asyncio.run(extract_details(pages, headless, user_agent))
+    # columns of the results, only these are read from the pages
+    fields = select_fields(fields)
+
+    if reextract and not cache_folder:
+        raise ValueError("reextract=True parses the cached pages again, it needs a cache_folder")
+
+    # per-stage timing, scraped by prometheus while the run goes on
+    if metrics_port is not None:
+        METRICS.serve(metrics_port)
+
+    # stream of pages to be scraped
+    # with a registry, the next batch of missing / failed / stale urls replaces the csv
+    registry = UrlRegistry(registry_path) if registry_path else None
+    if registry is not None and reextract:
+        # the registry only hands out urls still to scrape, which are mostly not cached:
+        # every page of the cache is parsed again instead
+        pages = None
+        total = None
+    elif registry is not None:
+        pages = registry.next_batch(idx_range[1] - idx_range[0])
+        # the registry already skips finished urls, so every batch gets its own journal
+        filename = f"registry_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    elif "missing" not in filename:
+        pages = iter_urls(filename, idx_range)
+        total = idx_range[1] - idx_range[0]
+    else:
+        pages = iter_urls(filename)
+        total = None
+
+    # every product is scraped once, whatever the form of its urls (/dp/, /gp/product/, query strings)
+    # its result is fanned back out to every original url when the results are written
+    deduper = UrlDeduper()
+    if pages is None:
+        pass
+    elif registry is not None:
+        pages = list(deduper.unique(pages))
+        total = len(pages)
+    else:
+        pages = deduper.unique(pages)
 
-    # convert result list to dataframe
-    df = pd.DataFrame(results)
- 
-    # save to csv
     FOLDER_NAME = "results"
-    if not os.path.exists(FOLDER_NAME):                                                                                                                                                          
+    if not os.path.exists(FOLDER_NAME):
         os.makedirs(FOLDER_NAME)
 
+    # raw html cache, consulted before touching the network
+    cache = PageCache(cache_folder) if cache_folder else None
+
+    if reextract:
+        results = reextract_details(pages, cache, fields)
+        if not results:
+            print(f"warning: no cached page re-extracted from {cache_folder}, the output is empty")
+        records = deduper.fan_out_records(results)
+    else:
+        # results are journaled as they finish, rerunning the same range resumes it
+        source_name = os.path.splitext(os.path.basename(filename))[0]
+        journal_path = os.path.join(FOLDER_NAME, "journal", f"{source_name}_from_{idx_range[0]}_to_{idx_range[1]}.jsonl")
+        with ResultJournal(journal_path) as journal:
+            # journals of older runs may hold the original urls
+            done = {canonicalize_url(url) for url in journal.completed()}
+            pages = (page for page in pages if page not in done)
+            if total is not None:
+                total = max(total - len(done), 0)
+
+            # request rate shared by every session, instead of a random delay per page
+            limiter = AdaptiveRateLimiter(rate=initial_rate, max_rate=max_rate)
+
+            asyncio.run(extract_details(pages, journal, headless, user_agent, concurrency, max_pages_per_session, total, engine, pool_size, cache, limiter, registry, browser_profile, fields))
+
+        # latest result of every page in the journal, for every original url
+        records = deduper.fan_out_records(journal.iter_records())
+
+    if cache is not None:
+        cache.close()
+    if registry is not None:
+        registry.close()
+ 
+    # save to csv, or parquet with the categories as a native list column
     now = datetime.now()                                                                                                                                             
     datetime_string = now.strftime("%Y%m%d_%H%M%S")
-    filename = f"{datetime_string}_from_{idx_range[0]}_to_{idx_range[1]}_scrap_results.csv"
-    df.to_csv(os.path.join(FOLDER_NAME, filename), index=False)
+    filename = f"{datetime_string}_from_{idx_range[0]}_to_{idx_range[1]}_scrap_results"
+    if output_format == "parquet":
+        with span("write_output"):
+            write_parquet(records, os.path.join(FOLDER_NAME, f"{filename}.parquet"), schema=result_schema(fields))
+    else:
+        with span("write_output"):
+            pd.DataFrame(list(records)).to_csv(os.path.join(FOLDER_NAME, f"{filename}.csv"), index=False)
+
+    # where the seconds per page went
+    METRICS.write_summary(os.path.join(FOLDER_NAME, "metrics", f"{filename}.json"))
+    print(METRICS.summary())
 
 
 if __name__ == "__main__":
     # please specify the index range here
-    main(idx_range=(0, 10000), headless=True, user_agent=False, filename="ProductURL_missing.csv")
+    # set reextract=True to parse the pages in cache_folder again without scraping
+    # the next urls to scrape come from the url registry filled by "01. generate_urls_to_scrap.py",
+    # set registry_path=None to read them from filename instead
+    # set metrics_port to serve per-stage timings to prometheus while scraping
+    # set browser_profile="lean" to skip images, fonts and ad requests in chrome
+    # set fields to the columns to scrape, ex: fields=("ProductTitle", "ProductCategories") or with "ProductDesc", "ProductImg"
+    main(idx_range=(0, 10000), headless=True, user_agent=False, filename="ProductURL_missing.csv", registry_path="results/url_registry.sqlite")
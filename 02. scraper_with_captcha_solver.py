@@ -8,7 +8,19 @@ import pandas as pd
 
 # scraping
 import asyncio  # concurrent processing
-from arsenic import get_session, browsers, services  # async selenium
+from session_pool import SessionPool  # reusable arsenic sessions
+from profile_dirs import ProfileDirs  # disposable chrome profiles
+from http_scraper import HttpFetcher, extract_page_http, parse_product_html  # browserless fast path
+from page_cache import PageCache  # raw html cache
+from extractors import DEFAULT_FIELDS, select_fields, extract_raw, build_result, classify  # field registry
+from scheduler import run_bounded  # bounded concurrency
+from rate_limiter import AdaptiveRateLimiter  # adaptive request rate
+from url_source import iter_urls  # stream urls from csv
+from url_utils import UrlDeduper, canonicalize_url  # one scrape per product
+from url_registry import UrlRegistry  # scraping status of every url
+from journal import ResultJournal  # crash-safe results
+from result_sink import write_parquet, result_schema  # columnar output
+from metrics import METRICS, span, inc  # per-stage timing
 from datetime import datetime
 import os
 import random
@@ -19,20 +31,18 @@ import structlog
 
 # measure computation time
 from tqdm import tqdm
+from timeit import default_timer as timer
 
 # captcha solver
-from amazoncaptcha import AmazonCaptcha
-
-# delete temp files
-import glob
-import shutil
+from captcha_pool import CaptchaSolver
 
 
 def set_arsenic_log_level(level=logging.WARNING):
     logger = logging.getLogger("arsenic")
 
-    def logger_factory():
-        return logger
+    def logger_factory(*args):
+        # structlog.get_logger(name) goes to the stdlib logger of that name, ex: "metrics" spans
+        return logging.getLogger(args[0]) if args else logger
 
     structlog.configure(logger_factory=logger_factory)
     logger.setLevel(level)
@@ -58,171 +68,139 @@ def get_user_agent():
     user_agent = f"Mozilla/5.0 ({random.choice([mac_version, win_version, linux_version])}) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{chrome_version}.0.0.0 Safari/537.36"
     return user_agent
 
-async def captcha_solver(session):
-    # solve the captcha until correct
-    while True:
+async def captcha_solver(session, solver, limiter=None, max_attempts=5, backoff=2.0, fields=DEFAULT_FIELDS):
+    # solve the captcha until correct (or give up), returns the raw fields of the last page
+    digest = None
+    for attempt in range(max_attempts + 1):
+        with span("extract"):
+            raw = await extract_raw(session, fields)
+
+        # the previous solution was right if the captcha is gone
+        if digest is not None:
+            solver.feedback(digest, not raw["captcha"])
+
+        if not raw["captcha"] or attempt == max_attempts:
+            return raw
+
+        # let the shared rate limiter know captchas are showing up
+        if limiter is not None:
+            limiter.record("captcha")
+
+        # wait a bit longer after every failed attempt
+        if attempt > 0:
+            await asyncio.sleep(backoff * 2 ** (attempt - 1))
+
+        with span("captcha", attempt=attempt):
+            # get captcha link
+            img_el = await session.get_element("img")
+            img_src = await img_el.get_attribute("src")
+
+            # solve the captcha, off the event loop
+            digest, solution = await solver.solve(img_src)
+
+            # input solution to textbox
+            textbox_el = await session.get_element("#captchacharacters")
+            await textbox_el.clear()
+            await textbox_el.send_keys(solution)
+
+            # click submit button
+            button_el = await session.get_element("button")
+            await button_el.click()
+
+
+async def extract_page(session, url, solver, cache=None, limiter=None, fields=DEFAULT_FIELDS):
+    # navigate to the web page
+    with span("navigate"):
+        await session.get(url)
+
+    # SOLVING CAPTCHA
+    # the fields of the page come with the captcha check, in a single round trip
+    raw = await captcha_solver(session, solver, limiter, fields=fields)
+
+    # keep the html so the page can be parsed again without the network
+    if cache is not None and not raw["captcha"]:
+        cache.put(url, await session.get_page_source())
+
+    return build_result(url, raw, fields)
+
+
+async def extract_details(urls, journal, headless, random_user_agent, profile_root=None, concurrency=1, max_pages_per_session=100, total=None, engine="browser", pool_size=None, cache=None, limiter=None, registry=None, browser_profile="default", fields=DEFAULT_FIELDS):
+    # one browser session per concurrent task, unless the browser is only a fallback
+    # random user_agent to avoid captcha, picked once per browser launch
+    pool = SessionPool(
+        size=pool_size or concurrency,
+        headless=headless,
+        user_agent_list=user_agent_list if random_user_agent else None,
+        max_pages=max_pages_per_session,
+        profile=browser_profile,
+        # every browser gets its own profile folder, removed when the browser is retired
+        profile_dirs=ProfileDirs(profile_root),
+    )
+
+    # request rate shared by every session, adapts to captcha / not found pages
+    if limiter is None:
+        limiter = AdaptiveRateLimiter()
+
+    # captcha images are downloaded and solved outside of the event loop
+    solver = CaptchaSolver()
+
+    # plain http client for the fast path
+    fetcher = HttpFetcher(concurrency, user_agent_list if random_user_agent else None)
+
+    async def scrape(url):
+        # cached html, no network at all
+        if cache is not None:
+            page_html = cache.get(url)
+            if page_html is not None:
+                result = parse_product_html(url, page_html, fields)
+                if result is not None:
+                    return result
+
+        if engine == "http":
+            await limiter.acquire()
+            start = timer()
+            result = await extract_page_http(fetcher, url, cache, fields)
+            limiter.record(classify(result), timer() - start)
+            if result is not None:
+                return result
+
+        # browser engine, or fallback for pages the http engine can't handle
+        await limiter.acquire()
+        start = timer()
         try:
-            h4_el = await session.get_element("h4")
-            h4_text = await h4_el.get_text()
-            is_captcha_page = (h4_text == 'Enter the characters you see below')
-        except:
-            is_captcha_page = False
-
-        if not is_captcha_page:
-            return
-    
-        # get captcha link
-        img_el = await session.get_element("img")
-        img_src = await img_el.get_attribute("src")
-
-        # solve the captcha
-        captcha = AmazonCaptcha.fromlink(img_src)
-        solution = captcha.solve()
-            
-        # input solution to textbox
-        textbox_el = await session.get_element("#captchacharacters")
-        await textbox_el.clear()
-        await textbox_el.send_keys(solution)
-            
-        # click submit button
-        button_el = await session.get_element("button")
-        await button_el.click()
-
-
-async def extract_details(urls, headless, random_user_agent, temp_file_path):
-    # for delete temporary files
-    delete_temp_every = 50
-    url_counter = 0
-
-    # iterate through multiple pages
-    results = []
-    for url in tqdm(urls):
-        # configure the web driver
-        service = services.Chromedriver()
-        browser = browsers.Chrome()
-        browser.capabilities = {
-            "goog:chromeOptions": {
-                "args": [
-                    #"--headless",
-                    "--disable-gpu",
-                    "--no-sandbox",
-                    "--disable-dev-shm-usage",
-                    "--disable-extensions",
-                    "--disable-infobars",
-                    "--disable-notifications",
-                    "--disable-logging",
-                    "--mute-audio",
-                ]
-            }
-        }
-
-        if headless:
-            browser.capabilities['goog:chromeOptions']['args'].append("--headless")
-
-        # random user_agent to avoid captcha
-        if random_user_agent:
-            user_agent_string = random.choice(user_agent_list)
-            # user_agent_string = get_user_agent()
-            browser.capabilities['goog:chromeOptions']['args'].append(f"user-agent={user_agent_string}")
-
-        async with get_session(service, browser) as session:
-            # navigate to the web page
-            await session.get(url)
-
-            # SOLVING CAPTCHA
-            await captcha_solver(session)
-
-            # get the title of the current page
-            document_title = await session.execute_script("return document.title;")
-
-            # skip scraping process if page not found, ex: https://www.amazon.com/dp/B004N5KULM
-            if document_title == "Page Not Found":
-                results.append(
-                    {
-                        "ProductURL": url,
-                        "ProductTitle": document_title,
-                    }
-                )
-                continue
-
-
-            # extract the text content of the page
-            ## TITLE
-            try:
-                title_el = await session.get_element("#productTitle")
-                title_text = await title_el.get_text()
-            except:
-                title_text = ""
-
-            ## BYLINE INFO
-            try:
-                byline_el = await session.get_element("#bylineInfo")
-                byline_text = await byline_el.get_text()
-            except:
-                byline_text = ""
-
-            ## BRAND
-            try:
-                table_el = await session.get_element("table")
-                table_text = await table_el.get_text()
-                brand_text = table_text.split('Brand ')[1].split('\n')[0]
-            except:
-                brand_text = ""
-
-            ## DESCRIPTION
-            """
-            try:
-                description_el = await session.get_element("#productDescription")
-                description_text = await description_el.get_text()
-            except:
-                # not all product have description
-                description_text = ""
-            """
-
-            ## FIRST IMAGE
-            """
-            try:
-                img_el = await session.get_element("#imgTagWrapperId")
-                img_el_img = await img_el.get_element("img")
-                img_src = await img_el_img.get_attribute("src")
-            except:
-                img_src = ""
-            """
-
-            ## CATEGORIES
-            try:
-                cat_el = await session.get_element(".a-subheader")
-                cat_text = await cat_el.get_text()
-                cat_text_list = cat_text.split("\n")[::2]
-            except:
-                # not all product have categories, ex: https://www.amazon.com/dp/B001EO5TPM
-                cat_text_list = ""
-
-            results.append(
-                {
-                    "ProductURL": url,
-                    "ProductTitle": title_text,
-                    "ProductBylineInfo": byline_text,
-                    "ProductBrandFromTable": brand_text,
-                    # "ProductDesc": description_text,
-                    # "ProductImg": img_src,
-                    "ProductCategories": cat_text_list,
-                }
-            )
-
-        # delete temp files
-        url_counter += 1
-        if url_counter % delete_temp_every == 0:
-            try:
-                for f in glob.glob(f"{temp_file_path}/scoped_dir*"):
-                    shutil.rmtree(f)
-            except Exception as e:
-                    print(e)
-
-    return results
-
-
-def main(filename, idx_range, headless, random_user_agent, temp_file_path):
+            async with pool.session() as session:
+                result = await extract_page(session, url, solver, cache, limiter, fields)
+        except Exception as e:
+            # keep the url so it shows up as missing and can be scraped again
+            print(e)
+            result = {"ProductURL": url}
+        limiter.record(classify(result), timer() - start)
+        return result
+
+    # scrape the pages concurrently, reusing the browsers in the pool
+    # every result goes straight to the journal instead of a list in memory
+    progress = tqdm(total=total)
+
+    def collect(result):
+        inc("pages_total", outcome=classify(result))
+        with span("write"):
+            journal.append(result)
+        if registry is not None:
+            registry.record(result)
+        progress.update()
+        progress.set_postfix(rate=limiter.rate, captcha=limiter.counts["captcha"], refresh=False)
+
+    with solver:
+        async with pool, fetcher:
+            await run_bounded(urls, scrape, concurrency, on_result=collect)
+    progress.close()
+
+    print(pd.DataFrame(pool.report()))
+    print(limiter.metrics())
+    print(solver.metrics())
+
+
+def main(filename, idx_range, headless, random_user_agent, profile_root=None, concurrency=1, max_pages_per_session=100, engine="browser", pool_size=None, cache_folder=None, initial_rate=1.0, max_rate=5.0, output_format="csv", registry_path=None, metrics_port=None, browser_profile="default", fields=DEFAULT_FIELDS):
     """
     Scrape product details from Amazon using Arsenic.
 
@@ -230,42 +208,112 @@ def main(filename, idx_range, headless, random_user_agent, temp_file_path):
         filename (str): Name of the CSV file containing the "ProductURL" column to be scraped.
         idx_range (tuple): Start and end index (end index not included) of the rows to be scraped from the CSV file.
         headless (bool): If True, the browser UI won't pop up during the scraping process.
-        random_user_agent (bool): If True, a random user agent will be used for each page.
-        temp_file_path (str): Path to the directory where the temporary files will be stored during the scraping process.
+        random_user_agent (bool): If True, a random user agent will be used for each browser session.
+        profile_root (str): Folder of the per-browser chrome profiles, defaults to a folder in /dev/shm (or the temp folder).
+        concurrency (int): Number of pages scraped at the same time, each with its own browser session.
+        max_pages_per_session (int): Number of pages a browser session handles before it is restarted.
+        engine (str): "browser" to load every page in chrome, or "http" to parse the html directly
+            and only fall back to chrome for pages that can't be parsed (ex: captcha).
+        pool_size (int): Number of browser sessions, defaults to `concurrency`. Can be much smaller with the "http" engine.
+        cache_folder (str): If given, raw page html is cached there and cached pages are parsed without scraping.
+        initial_rate (float): Pages per second at the start, adapted to the captcha rate while scraping.
+        max_rate (float): Highest number of pages per second.
+        output_format (str): "csv", or "parquet" to store the categories as a native list column.
+        registry_path (str): If given, the next missing / failed / stale urls of this url registry are scraped
+            instead of the rows of `filename` (at most as many as in `idx_range`), and their status is updated.
+        metrics_port (int): If given, per-stage timings are served to prometheus on this port while scraping.
+            A json summary is written to results/metrics at the end of every run.
+        browser_profile (str): "default", or "lean" to block images, media, fonts and ad / tracking requests
+            and to return from navigation once the DOM is ready.
+        fields (iterable): Columns to scrape, see extractors.FIELDS, ex: ("ProductTitle", "ProductCategories").
+            Only these are read from the pages, ProductTitle is always included.
     """
 
     # suppress log from arsenic
     set_arsenic_log_level()
 
-    # list of pages to be scraped
-    pages = pd.read_csv(filename)["ProductURL"].to_list()
-    pages = pages[idx_range[0] : idx_range[1]]
+    # columns of the results, only these are read from the pages
+    fields = select_fields(fields)
 
-    results = asyncio.run(extract_details(pages, headless, random_user_agent, temp_file_path))
+    # per-stage timing, scraped by prometheus while the run goes on
+    if metrics_port is not None:
+        METRICS.serve(metrics_port)
+
+    # stream of pages to be scraped
+    registry = UrlRegistry(registry_path) if registry_path else None
+    if registry is not None:
+        pages = registry.next_batch(idx_range[1] - idx_range[0])
+        # the registry already skips finished urls, so every batch gets its own journal
+        filename = f"registry_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    else:
+        pages = iter_urls(filename, idx_range)
+        total = idx_range[1] - idx_range[0]
+
+    # every product is scraped once, whatever the form of its urls (/dp/, /gp/product/, query strings)
+    # its result is fanned back out to every original url when the results are written
+    deduper = UrlDeduper()
+    if registry is not None:
+        pages = list(deduper.unique(pages))
+        total = len(pages)
+    else:
+        pages = deduper.unique(pages)
 
-    # convert result list to dataframe
-    df = pd.DataFrame(results)
- 
-    # save to csv
     FOLDER_NAME = "results"
-    if not os.path.exists(FOLDER_NAME):                                                                                                                                                          
+    if not os.path.exists(FOLDER_NAME):
         os.makedirs(FOLDER_NAME)
 
+    # raw html cache, consulted before touching the network
+    cache = PageCache(cache_folder) if cache_folder else None
+
+    # request rate shared by every session
+    limiter = AdaptiveRateLimiter(rate=initial_rate, max_rate=max_rate)
+
+    # results are journaled as they finish, rerunning the same range resumes it
+    source_name = os.path.splitext(os.path.basename(filename))[0]
+    journal_path = os.path.join(FOLDER_NAME, "journal", f"{source_name}_from_{idx_range[0]}_to_{idx_range[1]}.jsonl")
+    with ResultJournal(journal_path) as journal:
+        # journals of older runs may hold the original urls
+        done = {canonicalize_url(url) for url in journal.completed()}
+        pages = (page for page in pages if page not in done)
+        total = max(total - len(done), 0)
+
+        asyncio.run(extract_details(pages, journal, headless, random_user_agent, profile_root, concurrency, max_pages_per_session, total, engine, pool_size, cache, limiter, registry, browser_profile, fields))
+
+    if cache is not None:
+        cache.close()
+    if registry is not None:
+        registry.close()
+
+    # latest result of every page in the journal, for every original url
+    records = deduper.fan_out_records(journal.iter_records())
+ 
+    # save to csv, or parquet with the categories as a native list column
     now = datetime.now()
     datetime_string = now.strftime("%Y%m%d_%H%M%S")
     if 'missing' in filename:
-        filename = f"{datetime_string}_missing_from_{idx_range[0]}_to_{idx_range[1]}_scrap_results.csv"
+        filename = f"{datetime_string}_missing_from_{idx_range[0]}_to_{idx_range[1]}_scrap_results"
     else:
-        filename = f"{datetime_string}_from_{idx_range[0]}_to_{idx_range[1]}_scrap_results.csv"
-    df.to_csv(os.path.join(FOLDER_NAME, filename), index=False)
+        filename = f"{datetime_string}_from_{idx_range[0]}_to_{idx_range[1]}_scrap_results"
+    if output_format == "parquet":
+        with span("write_output"):
+            write_parquet(records, os.path.join(FOLDER_NAME, f"{filename}.parquet"), schema=result_schema(fields))
+    else:
+        with span("write_output"):
+            pd.DataFrame(list(records)).to_csv(os.path.join(FOLDER_NAME, f"{filename}.csv"), index=False)
+
+    # where the seconds per page went
+    METRICS.write_summary(os.path.join(FOLDER_NAME, "metrics", f"{filename}.json"))
+    print(METRICS.summary())
 
 
 if __name__ == "__main__":
     # please specify the parameters here
+    # the next urls to scrape come from the url registry filled by "01. generate_urls_to_scrap.py",
+    # set registry_path=None to read them from filename instead
     main(
         filename="ProductURL.csv",
         idx_range=(30000, 35000),
         headless=True,
         random_user_agent=False,
-        temp_file_path="C:/Users/tomyt/AppData/Local/Temp",
+        registry_path="results/url_registry.sqlite",
     )
@@ -1,28 +1,30 @@
-import pandas as pd
-from glob import glob
+from results_store import ResultsStore, read_results
 
 
-def fill_missing_urls(full_data_path, missing_data_path):
-    # read both dataframe
-    full_df = pd.read_csv(full_data_path).set_index("ProductURL")
-    missing_df = pd.read_csv(missing_data_path).set_index("ProductURL")
+def fill_missing_urls(missing_data_path, store_path="results/combined/scrap_results.sqlite", full_data_path=None, export_path=None):
+    """
+    Fill the products missing in the results store with a file of re-scraped urls.
 
-    # perform a left join
-    merged_df = pd.merge(full_df, missing_df, how='left', left_index=True, right_index=True, suffixes=('', '_temp'))
+    Parameters:
+        missing_data_path (str): Csv or parquet file with the re-scraped urls.
+        store_path (str): Path of the results store (see results_store.py).
+        full_data_path (str): If given, this results file is merged into the store first (skipped if already merged).
+        export_path (str): If given, the whole store is also written to this csv.
+    """
+    store = ResultsStore(store_path)
 
-    # fill in missing values of left df with right df
-    for col in full_df.columns:
-        merged_df[col].fillna(merged_df[f"{col}_temp"], inplace=True)
+    # the left df, only read if it is new or changed since the last merge
+    if full_data_path is not None:
+        store.ingest([full_data_path])
 
-    # delete temporary columns
-    merged_df = merged_df.drop(columns=merged_df.filter(regex='_temp').columns)
+    # only rows still missing their title are updated
+    filled = store.upsert_missing(read_results(missing_data_path))
+    print(f"FILLED: {filled}")
+    print(f"REMAINING MISSING VALUES: {store.count_missing()}")
 
-    # reset index
-    merged_df = merged_df.reset_index()
-
-    # save csv, replace with the left df
-    merged_df.to_csv(full_data_path, index=False)
-    print(f"REMAINING MISSING VALUES: {merged_df[merged_df['ProductTitle'].isna()].shape[0]}")
+    if export_path is not None:
+        store.to_csv(export_path)
+    store.close()
 
 if __name__ == "__main__":
     # this will be the left df
@@ -31,4 +33,4 @@ if __name__ == "__main__":
     # this will be the right df
     missing_data_path = "results/20230415_061429_missing_from_0_to_2869_scrap_results.csv"
 
-    fill_missing_urls(full_data_path, missing_data_path)
+    fill_missing_urls(missing_data_path, full_data_path=full_data_path)
@@ -4,11 +4,21 @@ nan = float('nan')
 from glob import glob
 import os
 from datetime import datetime
+from cleaning import split_categories
+from results_store import ResultsStore
 
-# read all csv inside the folder
+# merge only the new or changed csv and parquet files into the combined store
 FOLDER_NAME = "results"
-df_list = [pd.read_csv(filename) for filename in glob(os.path.join(FOLDER_NAME, "*.csv"))]
-df = pd.concat(df_list).reset_index(drop=True)
+SUBFOLDER_NAME = "combined"
+SUBFOLDER_PATH = os.path.join(FOLDER_NAME, SUBFOLDER_NAME)
+store = ResultsStore(os.path.join(SUBFOLDER_PATH, "scrap_results.sqlite"))
+filenames = sorted(glob(os.path.join(FOLDER_NAME, "*.csv")) + glob(os.path.join(FOLDER_NAME, "*.parquet")))
+merged = store.ingest(filenames)
+print(f"MERGED FILES: {len(merged)}")
+
+# one row per ProductURL
+df = store.to_frame()
+store.close()
 
 # PREPROCESS ProductBylineInfo and ProductBrandFromTable 
 brand1 = df['ProductBrandFromTable'].str.upper()
@@ -17,8 +27,8 @@ df['ProductBrand'] = brand1.fillna(brand2)
 
 # PREPROCESS ProductCategories
 # split list of ProductCategories into multiple columns
-df_cat = pd.DataFrame([pd.Series(pd.eval(x)) for x in df['ProductCategories']])
-df_cat.columns = [f"ProductCategories_{x+1}" for x in df_cat.columns]
+# the store returns native lists, whatever the format of the result files
+df_cat = split_categories(df['ProductCategories'])
 
 # combine both dataframe
 df = pd.concat([df, df_cat], axis=1)
@@ -29,10 +39,6 @@ df.drop(columns=['ProductBrandFromTable', 'ProductBylineInfo', 'ProductCategorie
 print(df.shape[0])
 
 # save to csv
-SUBFOLDER_NAME = "combined"
-SUBFOLDER_PATH = os.path.join(FOLDER_NAME, SUBFOLDER_NAME)
-if not os.path.exists(SUBFOLDER_PATH):
-    os.makedirs(SUBFOLDER_PATH)
 
 now = datetime.now()
 datetime_string = now.strftime("%Y%m%d_%H%M%S")
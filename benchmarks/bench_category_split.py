@@ -0,0 +1,74 @@
+# benchmark of the ProductCategories split in 04. scrap_results_final_cleaner.py
+# compares the previous row by row pd.eval with cleaning.split_categories
+#
+# usage: python benchmarks/bench_category_split.py [rows] [baseline_rows]
+
+import os
+import random
+import sys
+
+import numpy as np
+import pandas as pd
+
+# measure computation time
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from cleaning import split_categories
+
+
+CATEGORIES = [
+    "Grocery & Gourmet Food", "Snack Foods", "Cookies", "Beverages", "Coffee",
+    "Candy & Chocolate", "Pet Supplies", "Dogs", "Food", "Dry", "Baby",
+    "Health & Household", "Breakfast Foods", "Cereals", "Kellogg's",
+]
+
+
+def make_categories(rows, seed=0):
+    # mostly valid lists, some missing values and empty strings like the real results
+    rng = random.Random(seed)
+    values = []
+    for _ in range(rows):
+        r = rng.random()
+        if r < 0.05:
+            values.append(np.nan)
+        elif r < 0.08:
+            values.append("")
+        else:
+            values.append(str(rng.sample(CATEGORIES, rng.randint(1, 5))))
+    return pd.Series(values, name="ProductCategories")
+
+
+def baseline(categories):
+    # previous implementation, fails on NaN and "" so those are dropped first
+    valid = categories[categories.fillna("").str.len() > 0]
+    df_cat = pd.DataFrame([pd.Series(pd.eval(x)) for x in valid])
+    df_cat.columns = [f"ProductCategories_{x+1}" for x in df_cat.columns]
+    return df_cat
+
+
+def main(rows=1_000_000, baseline_rows=20_000):
+    categories = make_categories(rows)
+
+    start = timer()
+    df_cat = split_categories(categories)
+    vectorized_time = timer() - start
+    print(f"split_categories: {rows} rows in {vectorized_time:.2f}s -> {df_cat.shape}")
+
+    # the row by row version is far too slow for the full frame, time a sample and extrapolate
+    sample = categories.iloc[:baseline_rows]
+    start = timer()
+    baseline(sample)
+    baseline_time = (timer() - start) * rows / baseline_rows
+    print(f"pd.eval per row: {baseline_rows} rows timed, ~{baseline_time:.2f}s estimated for {rows} rows")
+    print(f"speedup: ~{baseline_time / vectorized_time:.0f}x")
+
+    # both give the same categories on the valid rows
+    valid = sample.fillna("").str.len() > 0
+    expected = baseline(sample).reset_index(drop=True)
+    actual = split_categories(sample)[valid.to_numpy()].reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual[expected.columns], expected, check_dtype=False)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,247 @@
+# benchmark of the scraper modes against the local mock amazon server
+# every mode scrapes the same urls, the report shows pages/sec (of the pages
+# scraped for good, failed pages are counted apart), p50/p95 page latency,
+# browser launches and peak memory of the whole process tree (python workers,
+# chromedrivers and chrome processes)
+#
+# usage: python benchmarks/bench_scrapers.py [pages] [mode ...]
+# modes: sequential, pooled, multiprocess, http (browser modes need chromedriver, the memory sampler needs psutil)
+# sequential is the scraper before the session pool: one page at a time, a new browser for every url
+
+import asyncio
+import glob
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+# measure computation time
+from timeit import default_timer as timer
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(__file__))
+from journal import ResultJournal
+from mock_amazon import MockAmazon
+from extractors import classify
+from rate_limiter import AdaptiveRateLimiter
+from session_pool import SessionPool
+from work_queue import open_queue
+
+
+MODES = ("sequential", "pooled", "multiprocess", "http")
+
+# the benchmark measures the scrapers, not the politeness of the rate limiter
+UNLIMITED_RATE = 1000.0
+
+
+def load_script(filename, name):
+    # the numbered scripts can't be imported with a regular import statement
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _write_event(events_dir, event):
+    # one file per process, worker processes inherit the probes when they are forked
+    with open(os.path.join(events_dir, f"events_{os.getpid()}.jsonl"), "a") as f:
+        f.write(json.dumps(event) + "\n")
+
+
+class TreeMemory:
+    """
+    Peak resident memory of a process and all its descendants, sampled in a thread.
+    ru_maxrss only sees the python process, chrome and chromedriver are children (or grandchildren) of it.
+
+    Parameters:
+        every (float): Seconds between two samples.
+    """
+
+    def __init__(self, every=0.2):
+        import psutil
+
+        self.psutil = psutil
+        self.every = every
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        root = self.psutil.Process()
+        while True:
+            total = 0
+            for process in [root] + root.children(recursive=True):
+                try:
+                    total += process.memory_info().rss
+                except (self.psutil.NoSuchProcess, self.psutil.AccessDenied):
+                    # exited between the listing and the read
+                    pass
+            self.peak = max(self.peak, total)
+            if self._stop.wait(self.every):
+                return
+
+    @property
+    def peak_mb(self):
+        return self.peak / 1024 ** 2
+
+
+def install_probes(module, names, events_dir):
+    """
+    Time every call of the per-page coroutines `names` of `module`, and record the
+    browser launches of the process when its session pool closes.
+    """
+    for name in names:
+        func = getattr(module, name)
+
+        async def probe(*args, _func=func, _name=name, **kwargs):
+            start = timer()
+            try:
+                return await _func(*args, **kwargs)
+            finally:
+                _write_event(events_dir, {"stage": _name, "latency": timer() - start})
+
+        setattr(module, name, probe)
+
+    class ProbedSessionPool(SessionPool):
+        async def close(self):
+            await super().close()
+            _write_event(events_dir, {
+                "stage": "pool",
+                "launches": sum(slot["Launches"] for slot in self.report()),
+            })
+
+    module.SessionPool = ProbedSessionPool
+
+
+def read_events(events_dir):
+    events = []
+    for path in glob.glob(os.path.join(events_dir, "events_*.jsonl")):
+        with open(path) as f:
+            for line in f:
+                events.append({**json.loads(line), "pid": os.path.basename(path)[7:-6]})
+    return pd.DataFrame(events, columns=["stage", "latency", "launches", "pid"])
+
+
+def run_scraper(mode, urls, workdir, concurrency, browser_profile="default"):
+    # sequential / pooled / http modes of 02. scraper.py
+    scraper = load_script("02. scraper.py", "scraper")
+    scraper.set_arsenic_log_level()
+    install_probes(scraper, ["extract_page", "extract_page_http"], workdir)
+
+    settings = {
+        # no reuse of the browser, like the scraper before the session pool (its page reads are the batched script though)
+        "sequential": {"concurrency": 1, "engine": "browser", "max_pages_per_session": 1},
+        "pooled": {"concurrency": concurrency, "engine": "browser"},
+        "http": {"concurrency": concurrency, "engine": "http", "pool_size": 1},
+    }[mode]
+    limiter = AdaptiveRateLimiter(rate=UNLIMITED_RATE, max_rate=UNLIMITED_RATE)
+
+    with ResultJournal(os.path.join(workdir, "journal.jsonl")) as journal:
+        asyncio.run(scraper.extract_details(urls, journal, headless=True, total=len(urls), limiter=limiter, browser_profile=browser_profile, **settings))
+    return journal.records()
+
+
+def run_multiprocess(urls, workdir, concurrency, num_cores, browser_profile="default"):
+    # a regular import, the worker processes look the task functions up by module name
+    import scraper_multiprocessing as scraper
+    install_probes(scraper, ["extract_details"], workdir)
+
+    queue_spec = os.path.join(workdir, "queue.sqlite")
+    queue = open_queue(queue_spec)
+    queue.put(urls)
+    scraper.run_workers(queue_spec, num_cores, concurrency, initial_rate=UNLIMITED_RATE, max_rate=UNLIMITED_RATE, browser_profile=browser_profile)
+    # urls not done (failed, or left pending for a later run) count as errors, like the failed pages of the other modes
+    records = list(queue.results())
+    records += [{"ProductURL": None}] * (len(urls) - len(records))
+    queue.close()
+    return records
+
+
+def run_mode(mode, urls, concurrency=4, num_cores=2, browser_profile="default"):
+    workdir = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    try:
+        with TreeMemory() as memory:
+            start = timer()
+            if mode == "multiprocess":
+                records = run_multiprocess(urls, workdir, concurrency, num_cores, browser_profile)
+            else:
+                records = run_scraper(mode, urls, workdir, concurrency, browser_profile)
+            elapsed = timer() - start
+        events = read_events(workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    outcomes = pd.Series([classify(record) for record in records], dtype=object).value_counts()
+    latencies = events["latency"].dropna().to_numpy()
+    pools = events[events["stage"] == "pool"]
+    # captchas and errors come back fast, they would inflate the rate
+    scraped = int(outcomes.get("ok", 0) + outcomes.get("not_found", 0))
+    return {
+        "Mode": mode,
+        "Pages": len(records),
+        "Seconds": round(elapsed, 2),
+        "PagesPerSec": round(scraped / elapsed, 2),
+        "Failed": len(records) - scraped,
+        "P50": round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+        "P95": round(float(np.percentile(latencies, 95)), 3) if len(latencies) else None,
+        "Launches": int(pools["launches"].sum()),
+        "Workers": pools["pid"].nunique(),
+        "MaxRssMB": round(memory.peak_mb, 1),
+        **{outcome: int(outcomes.get(outcome, 0)) for outcome in ("ok", "not_found", "captcha", "error")},
+    }
+
+
+def main(pages=200, modes=MODES, concurrency=4, num_cores=2, latency=0.2, captcha_probability=0.05, not_found_probability=0.05, pages_folder=None, port=8765, browser_profile="default"):
+    """
+    Run every mode against a fresh mock server and print the report.
+
+    Parameters:
+        pages (int): Number of product urls scraped by every mode.
+        modes (iterable): Modes to benchmark, see MODES.
+        concurrency (int): Concurrent pages (per process) of the pooled, multiprocess and http modes.
+        num_cores (int): Number of worker processes of the multiprocess mode.
+        latency (float): Seconds the mock server waits before answering a page.
+        captcha_probability (float): Probability of a captcha page.
+        not_found_probability (float): Share of dead product urls.
+        pages_folder (str): Folder of recorded product pages served by the mock server.
+        port (int): Port of the mock server.
+        browser_profile (str): Chrome profile of the browser modes, "default" or "lean".
+    """
+    report = []
+    for mode in modes:
+        # same random draws for every mode
+        server = MockAmazon(latency, captcha_probability=captcha_probability, not_found_probability=not_found_probability, pages_folder=pages_folder)
+        server.start_in_thread(port=port)
+        try:
+            report.append(run_mode(mode, server.product_urls(pages), concurrency, num_cores, browser_profile))
+        except Exception as e:
+            # ex: no chromedriver for the browser modes
+            print(f"{mode} failed: {e!r}")
+            report.append({"Mode": mode, "Error": repr(e)})
+        finally:
+            server.stop_in_thread()
+
+    print(pd.DataFrame(report).to_string(index=False))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args:
+        main(int(args[0]), args[1:] or MODES)
+    else:
+        main()
@@ -0,0 +1,161 @@
+# local stand-in for amazon product pages, used by the scraper benchmarks
+# serves product pages (recorded html files or a built-in template), "Page Not
+# Found" pages and captcha pages, with a configurable latency and captcha rate
+#
+# usage: python benchmarks/mock_amazon.py [port]
+
+import asyncio
+import glob
+import os
+import random
+import sys
+import threading
+import zlib
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from extractors import CAPTCHA_TEXT
+
+
+PRODUCT_TEMPLATE = """<html>
+<head><title>Amazon.com : {title} : Grocery &amp; Gourmet Food</title></head>
+<body>
+<div class="a-subheader"><ul>
+<li><span>Grocery &amp; Gourmet Food</span></li><li><span>›</span></li>
+<li><span>Snack Foods</span></li><li><span>›</span></li>
+<li><span>{category}</span></li>
+</ul></div>
+<span id="productTitle">  {title}  </span>
+<a id="bylineInfo">Visit the {brand} Store</a>
+<table>
+<tr><td>Brand</td><td>{brand}</td></tr>
+<tr><td>Flavor</td><td>Original</td></tr>
+</table>
+</body>
+</html>"""
+
+NOT_FOUND_PAGE = """<html>
+<head><title>Page Not Found</title></head>
+<body><img alt="Sorry! We couldn't find that page."></body>
+</html>"""
+
+CAPTCHA_PAGE = """<html>
+<head><title>Amazon.com</title></head>
+<body>
+<h4>{text}</h4>
+<img src="/captcha.gif">
+<form action="/errors/validateCaptcha"><input id="captchacharacters" name="field-keywords"><button type="submit">Continue shopping</button></form>
+</body>
+</html>""".format(text=CAPTCHA_TEXT)
+
+# 1x1 transparent gif
+CAPTCHA_IMAGE = bytes.fromhex("47494638396101000100800000000000ffffff21f90401000000002c00000000010001000002024401003b")
+
+CATEGORIES = ["Cookies", "Chips & Crisps", "Crackers", "Nuts & Seeds", "Popcorn", "Pretzels"]
+BRANDS = ["Kellogg's", "Nabisco", "Frito-Lay", "Planters", "Orville Redenbacher"]
+
+
+class MockAmazon:
+    """
+    Mock amazon server, a product page is served on /dp/<ASIN>.
+
+    Parameters:
+        latency (float): Seconds before every page is answered.
+        jitter (float): Relative random variation of the latency, ex: 0.5 for +/- 50%.
+        captcha_probability (float): Probability of answering a product request with a captcha page.
+        not_found_probability (float): Share of ASINs that are dead ("Page Not Found", status 404).
+        pages_folder (str): If given, product pages are served from the recorded *.html (or PageCache *.html.z) files in it.
+        seed (int): Seed of the random captcha and latency draws.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.5, captcha_probability=0.05, not_found_probability=0.05, pages_folder=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.captcha_probability = captcha_probability
+        self.not_found_probability = not_found_probability
+        self.random = random.Random(seed)
+        self.recorded = self._load_pages(pages_folder) if pages_folder else []
+        self.counts = {"product": 0, "not_found": 0, "captcha": 0}
+        self.url = None
+        self._runner = None
+        self._loop = None
+        self._thread = None
+
+    @staticmethod
+    def _load_pages(folder):
+        pages = []
+        for path in sorted(glob.glob(os.path.join(folder, "*.html"))):
+            with open(path, encoding="utf-8") as f:
+                pages.append(f.read())
+        for path in sorted(glob.glob(os.path.join(folder, "*.html.z"))):
+            with open(path, "rb") as f:
+                pages.append(zlib.decompress(f.read()).decode("utf-8"))
+        return pages
+
+    def _is_dead(self, asin):
+        # the same asin is always dead or alive, like the real site
+        return random.Random(asin).random() < self.not_found_probability
+
+    def _product_page(self, asin):
+        rng = random.Random(asin)
+        if self.recorded:
+            return rng.choice(self.recorded)
+        return PRODUCT_TEMPLATE.format(
+            title=f"Snack {asin}",
+            brand=rng.choice(BRANDS),
+            category=rng.choice(CATEGORIES),
+        )
+
+    async def product(self, request):
+        asin = request.match_info["asin"]
+        await asyncio.sleep(self.latency * (1 + self.jitter * (2 * self.random.random() - 1)))
+
+        if self._is_dead(asin):
+            self.counts["not_found"] += 1
+            return web.Response(text=NOT_FOUND_PAGE, status=404, content_type="text/html")
+        if self.random.random() < self.captcha_probability:
+            self.counts["captcha"] += 1
+            return web.Response(text=CAPTCHA_PAGE, content_type="text/html")
+        self.counts["product"] += 1
+        return web.Response(text=self._product_page(asin), content_type="text/html")
+
+    async def captcha_image(self, request):
+        return web.Response(body=CAPTCHA_IMAGE, content_type="image/gif")
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/dp/{asin}", self.product)
+        app.router.add_get("/captcha.gif", self.captcha_image)
+        return app
+
+    async def start(self, host="127.0.0.1", port=8080):
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def start_in_thread(self, host="127.0.0.1", port=8080):
+        # own event loop in a background thread, so sync code and other processes can use the server
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        return asyncio.run_coroutine_threadsafe(self.start(host, port), self._loop).result()
+
+    def stop_in_thread(self):
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def product_urls(self, n):
+        return [f"{self.url}/dp/B{i:09d}" for i in range(n)]
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    web.run_app(MockAmazon().app(), host="127.0.0.1", port=port)
@@ -0,0 +1,107 @@
+# solve amazon captchas without blocking the event loop
+# the image is downloaded in a thread and the ocr runs in a process pool,
+# solutions are memoized by image hash since amazon reuses its captcha images
+
+import asyncio
+import hashlib
+import io
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+
+# captcha solver
+from amazoncaptcha import AmazonCaptcha
+
+# measure computation time
+from timeit import default_timer as timer
+
+
+NOT_SOLVED = "Not solved"
+
+
+def _fetch_image(img_src, timeout=10):
+    response = requests.get(img_src, timeout=timeout)
+    response.raise_for_status()
+    return response.content
+
+
+def _solve_image(image_bytes):
+    # runs in a worker process
+    return AmazonCaptcha(io.BytesIO(image_bytes)).solve()
+
+
+class CaptchaSolver:
+    """
+    Off-loop AmazonCaptcha solver with memoized solutions.
+
+    Parameters:
+        processes (int): Number of worker processes running the ocr.
+        fetch_threads (int): Number of threads downloading captcha images.
+    """
+
+    def __init__(self, processes=1, fetch_threads=4):
+        self.processes = processes
+        self.fetch_threads = fetch_threads
+        self.solutions = {}
+        self._threads = None
+        self._pool = None
+
+        # statistics for the whole run
+        self.solved = 0
+        self.not_solved = 0
+        self.cache_hits = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.solve_time = 0.0
+
+    def __enter__(self):
+        self._threads = ThreadPoolExecutor(max_workers=self.fetch_threads)
+        self._pool = ProcessPoolExecutor(max_workers=self.processes)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._threads.shutdown()
+        self._pool.shutdown()
+
+    async def solve(self, img_src):
+        # returns the image hash (for `feedback`) and the solution text
+        loop = asyncio.get_running_loop()
+        start = timer()
+
+        image_bytes = await loop.run_in_executor(self._threads, _fetch_image, img_src)
+        digest = hashlib.sha1(image_bytes).hexdigest()
+
+        if digest in self.solutions:
+            self.cache_hits += 1
+            return digest, self.solutions[digest]
+
+        solution = await loop.run_in_executor(self._pool, _solve_image, image_bytes)
+        self.solve_time += timer() - start
+
+        if solution == NOT_SOLVED:
+            self.not_solved += 1
+        else:
+            self.solved += 1
+            self.solutions[digest] = solution
+        return digest, solution
+
+    def feedback(self, digest, accepted):
+        # amazon told us whether the solution was right, forget the wrong ones
+        if accepted:
+            self.accepted += 1
+        else:
+            self.rejected += 1
+            self.solutions.pop(digest, None)
+
+    def metrics(self):
+        attempts = self.solved + self.not_solved
+        submitted = self.accepted + self.rejected
+        return {
+            "solved": self.solved,
+            "not_solved": self.not_solved,
+            "cache_hits": self.cache_hits,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "success_rate": round(self.accepted / submitted, 3) if submitted else None,
+            "avg_solve_time": round(self.solve_time / attempts, 3) if attempts else None,
+        }
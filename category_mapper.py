@@ -0,0 +1,87 @@
+# map raw category predictions to the existing product categories
+# every raw label is scored against every category in one C-backed call
+# (rapidfuzz cdist), and the mapping is cached on disk so a rerun only scores
+# the labels it has never seen
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from rapidfuzz import fuzz, process, utils  # fast fuzzy matching
+
+from file_utils import write_json_atomic  # crash-safe cache
+
+
+# same two approaches as the original thefuzz extractOne calls
+SCORERS = (fuzz.WRatio, fuzz.token_sort_ratio)
+
+
+def _fingerprint(choices):
+    # the cache is only valid for the categories it was built with
+    return hashlib.sha1("\n".join(sorted(choices)).encode("utf-8")).hexdigest()
+
+
+class CategoryMapper:
+    """
+    Fuzzy mapping of raw labels to a fixed list of categories, with an on-disk cache.
+
+    Parameters:
+        choices (iterable): Existing categories, missing values are ignored.
+        cache_path (str): If given, json file where the mapping is kept between runs.
+        workers (int): Number of threads used to score, -1 for every core.
+    """
+
+    def __init__(self, choices, cache_path=None, workers=-1):
+        # distinct, in their original order, so ties go to the same category as before
+        self.choices = list(dict.fromkeys(choice for choice in choices if isinstance(choice, str)))
+        self.cache_path = cache_path
+        self.workers = workers
+
+        # choices are processed once instead of once per comparison
+        self._processed = [utils.default_process(choice) for choice in self.choices]
+        self._fingerprint = _fingerprint(self.choices)
+
+        # raw label -> [category, score]
+        self.mapping = {}
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache.get("fingerprint") == self._fingerprint:
+                self.mapping = cache["mapping"]
+
+    def _score(self, labels):
+        queries = [utils.default_process(label) for label in labels]
+
+        # best choice of every scorer, the first scorer wins ties like max() did
+        best_choice = np.zeros(len(labels), dtype=int)
+        best_score = np.full(len(labels), -1.0)
+        for scorer in SCORERS:
+            scores = process.cdist(queries, self._processed, scorer=scorer, processor=None, workers=self.workers)
+            choice = scores.argmax(axis=1)
+            score = scores[np.arange(len(labels)), choice]
+            better = score > best_score
+            best_choice[better] = choice[better]
+            best_score[better] = score[better]
+
+        for label, choice, score in zip(labels, best_choice, best_score):
+            self.mapping[label] = [self.choices[choice], float(score)]
+
+    def map(self, labels):
+        """
+        Returns a dict of every distinct label to its category, scoring only the unseen labels.
+        """
+        labels = {label for label in labels if isinstance(label, str)}
+        unseen = sorted(label for label in labels if label not in self.mapping)
+        if unseen and self.choices:
+            self._score(unseen)
+            self.save()
+        return {label: self.mapping[label][0] for label in labels if label in self.mapping}
+
+    def map_series(self, labels):
+        return labels.map(self.map(labels.unique()))
+
+    def save(self):
+        if self.cache_path is not None:
+            write_json_atomic(self.cache_path, {"fingerprint": self._fingerprint, "mapping": self.mapping})
@@ -0,0 +1,252 @@
+# predict product categories from reviews with the fine-tuned completion model
+# prompts are sent in batches (one request, many prompts), several requests run
+# at the same time under a requests / tokens per minute budget, and rate limited
+# or failed requests are retried with exponential backoff
+
+import asyncio
+import os
+
+import aiohttp  # async http client
+
+from scheduler import run_bounded  # bounded concurrency
+
+# measure computation time
+from timeit import default_timer as timer
+
+
+PROMPT_SUFFIX = " ->"  # separator used in the fine-tuning data
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class MinuteBudget:
+    """
+    Token bucket of requests and tokens per minute, shared by every concurrent request.
+
+    Parameters:
+        requests_per_minute (int): Maximum number of requests per minute.
+        tokens_per_minute (int): Maximum number of prompt + completion tokens per minute.
+    """
+
+    def __init__(self, requests_per_minute=60, tokens_per_minute=150000):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = requests_per_minute
+        self.available_tokens = tokens_per_minute
+        self.updated_at = timer()
+        self._lock = None
+
+    def _refill(self):
+        now = timer()
+        elapsed = now - self.updated_at
+        self.available_requests = min(self.requests_per_minute, self.available_requests + elapsed * self.requests_per_minute / 60)
+        self.available_tokens = min(self.tokens_per_minute, self.available_tokens + elapsed * self.tokens_per_minute / 60)
+        self.updated_at = now
+
+    async def acquire(self, tokens):
+        # the lock is created here so it belongs to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # a request bigger than the whole budget waits for a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.available_requests >= 1 and self.available_tokens >= tokens:
+                    self.available_requests -= 1
+                    self.available_tokens -= tokens
+                    return
+                wait_requests = (1 - self.available_requests) * 60 / self.requests_per_minute
+                wait_tokens = (tokens - self.available_tokens) * 60 / self.tokens_per_minute
+                await asyncio.sleep(max(wait_requests, wait_tokens, 0.01))
+
+
+class CategoryPredictor:
+    """
+    Async client of the completions endpoint, predicting one category per review.
+
+    Parameters:
+        model (str): Name of the fine-tuned model, ex: "ada:ft-personal-2023-04-15-02-52-12".
+        api_key (str): API key, defaults to the OPENAI_API_KEY environment variable.
+        base_url (str): Root of the API, can point to a local mock server.
+        organization (str): Organization id, defaults to the OPENAI_ORG environment variable.
+        batch_size (int): Number of prompts sent in a single request.
+        concurrency (int): Number of requests in flight at the same time.
+        requests_per_minute (int): Request budget of the API key.
+        tokens_per_minute (int): Token budget of the API key.
+        encoding (tiktoken.Encoding): If given, used to count tokens and cut reviews longer than `max_prompt_tokens`.
+            Otherwise a token is estimated as 4 characters.
+        max_prompt_tokens (int): Maximum number of tokens of a review.
+        max_tokens (int): Maximum number of tokens of a predicted category.
+        max_retries (int): Number of retries of a failed request before giving up.
+        backoff (float): Seconds to wait before the first retry, doubled after every retry.
+        timeout (int): Total timeout of a single request in seconds.
+    """
+
+    def __init__(
+        self,
+        model,
+        api_key=None,
+        base_url="https://api.openai.com/v1",
+        organization=None,
+        batch_size=20,
+        concurrency=4,
+        requests_per_minute=60,
+        tokens_per_minute=150000,
+        encoding=None,
+        max_prompt_tokens=1900,
+        max_tokens=5,
+        max_retries=5,
+        backoff=1.0,
+        timeout=60,
+    ):
+        self.model = model
+        self.api_key = api_key if api_key is not None else os.environ.get("OPENAI_API_KEY", "")
+        self.base_url = base_url.rstrip("/")
+        self.organization = organization if organization is not None else os.environ.get("OPENAI_ORG")
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.budget = MinuteBudget(requests_per_minute, tokens_per_minute)
+        self.encoding = encoding
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_tokens = max_tokens
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.client = None
+
+        # statistics for the whole run
+        self.requests = 0
+        self.retries = 0
+        self.failed = 0
+        self.tokens = 0
+
+    async def __aenter__(self):
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        if self.organization:
+            headers["OpenAI-Organization"] = self.organization
+        self.client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers=headers,
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.client.close()
+
+    def prepare(self, review):
+        # (review cut to the token limit, its number of tokens)
+        if self.encoding is None:
+            review = review[: self.max_prompt_tokens * 4]
+            return review, len(review) // 4 + 1
+        review_encode = self.encoding.encode(review)
+        if len(review_encode) >= self.max_prompt_tokens:
+            review_encode = review_encode[: self.max_prompt_tokens]
+            review = self.encoding.decode(review_encode)
+        return review, len(review_encode)
+
+    async def complete(self, prompts, tokens):
+        """
+        Send one batch of prompts, returns one completion text per prompt (in order).
+        """
+        payload = {
+            "model": self.model,
+            "prompt": prompts,
+            "max_tokens": self.max_tokens,
+            "temperature": 0,
+        }
+        # completion tokens count against the budget too
+        tokens += self.max_tokens * len(prompts)
+
+        for attempt in range(self.max_retries + 1):
+            await self.budget.acquire(tokens)
+            self.requests += 1
+            retry_after = None
+            try:
+                async with self.client.post(f"{self.base_url}/completions", json=payload) as response:
+                    if response.status == 200:
+                        body = await response.json()
+                        self.tokens += tokens
+                        texts = [None] * len(prompts)
+                        # choices can come back in any order, `index` is the prompt position
+                        for choice in body["choices"]:
+                            texts[choice["index"]] = choice["text"]
+                        return texts
+                    if response.status not in RETRY_STATUSES:
+                        # ex: 400 for a prompt too long, retrying won't help and the other batches go on
+                        print(f"completion request failed with status {response.status}: {await response.text()}")
+                        break
+                    retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(e)
+
+            if attempt < self.max_retries:
+                self.retries += 1
+                delay = self.backoff * 2 ** attempt
+                if retry_after is not None:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                await asyncio.sleep(delay)
+
+        self.failed += len(prompts)
+        return [None] * len(prompts)
+
+    async def predict(self, rows, on_result=None):
+        """
+        Predict the category of every product from its review.
+
+        Parameters:
+            rows (iterable): (ProductURL, review) pairs, or (ProductURL, review, tokens) triples
+                of prompts that already fit the token limit. Consumed lazily.
+            on_result (callable): Called with every prediction dict as soon as its batch is done.
+                If None, the predictions are collected and returned as a list.
+        """
+        results = []
+        if on_result is None:
+            on_result = results.append
+
+        def batches():
+            batch = []
+            for row in rows:
+                if len(row) > 2:
+                    # (ProductURL, prompt, tokens) from the prompt builder, already within the budget
+                    batch.append(tuple(row[:3]))
+                else:
+                    batch.append((row[0], *self.prepare(row[1])))
+                if len(batch) == self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        async def predict_batch(batch):
+            prompts = [review + PROMPT_SUFFIX for _, review, _ in batch]
+            labels = await self.complete(prompts, sum(tokens for _, _, tokens in batch))
+            return [
+                {
+                    "ProductURL": url,
+                    "Text": review,
+                    "ProductCategories_1_raw_prediction": label,
+                }
+                for (url, review, _), label in zip(batch, labels)
+            ]
+
+        def collect(predictions):
+            # failed predictions are left out, so they are predicted again next run
+            for prediction in predictions:
+                if prediction["ProductCategories_1_raw_prediction"] is not None:
+                    on_result(prediction)
+
+        await run_bounded(batches(), predict_batch, self.concurrency, on_result=collect)
+        return results
+
+    def metrics(self):
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failed": self.failed,
+            "tokens": self.tokens,
+        }
@@ -0,0 +1,66 @@
+# cleaning helpers for the combined scraping results
+
+import numpy as np
+import pandas as pd
+
+
+LIST_TYPES = (list, tuple, np.ndarray)
+
+# separator between two items of a python list repr, ex: "', '" or "\", '"
+ITEM_SEPARATOR = r"""['"], ['"]"""
+
+
+def _parse_category_strings(values):
+    # string repr of python lists, ex: "['Grocery & Gourmet Food', 'Snack Foods']"
+    # strip the brackets and outer quotes, split on the item separator, unescape
+    values = pd.Series(values, dtype=object)
+    is_repr = values.str.startswith("[").fillna(False) & values.str.endswith("]").fillna(False)
+    parsed = values.where(is_repr).str.slice(2, -2).str.split(ITEM_SEPARATOR, regex=True, expand=True)
+    if parsed.shape[1] == 0:
+        # nothing to split, keep one empty column so missing rows can be added
+        return pd.DataFrame({0: np.nan}, index=values.index, dtype=object)
+
+    parsed = parsed.replace("", np.nan)
+    parsed = parsed.where(parsed.notna(), np.nan)
+
+    # backslashes only show up in items holding both kinds of quotes, so this is rare
+    has_escape = values.str.contains("\\", regex=False).fillna(False).to_numpy(dtype=bool)
+    if has_escape.any():
+        parsed.loc[has_escape] = parsed.loc[has_escape].replace(r"\\(.)", r"\1", regex=True)
+    return parsed
+
+
+def split_categories(categories, prefix="ProductCategories_"):
+    """
+    Split a column of category lists into one column per level.
+
+    Accepts both the string repr written to the csv files and native lists
+    (parquet results). Missing values, empty strings and empty lists give a
+    row of NaN. Only the distinct strings are parsed, every row is then a
+    vectorized lookup, so the cost grows with the number of distinct
+    category paths instead of the number of rows.
+    """
+    categories = pd.Series(categories).reset_index(drop=True)
+    values = categories.to_numpy(dtype=object)
+    is_list = np.fromiter((isinstance(x, LIST_TYPES) for x in values), dtype=bool, count=len(values))
+
+    # string repr: parse the distinct values once, then take rows by code
+    codes, uniques = pd.factorize(categories.where(~is_list))
+    parsed = _parse_category_strings(uniques).reset_index(drop=True)
+
+    # rows with a missing value (code -1) point to an extra all-NaN row
+    parsed.loc[len(uniques)] = np.nan
+    codes = np.where(codes == -1, len(uniques), codes)
+    df_cat = parsed.take(codes).reset_index(drop=True)
+
+    # native lists: explode and pivot by position
+    if is_list.any():
+        items = categories[is_list].explode().replace("", np.nan).dropna()
+        position = items.groupby(level=0).cumcount()
+        df_list = pd.Series(items.to_numpy(), index=[items.index, position]).unstack()
+        df_cat = df_cat.reindex(columns=df_cat.columns.union(df_list.columns))
+        df_cat.loc[df_list.index, df_list.columns] = df_list
+
+    df_cat = df_cat.dropna(axis=1, how="all")
+    df_cat.columns = [f"{prefix}{x+1}" for x in range(df_cat.shape[1])]
+    return df_cat
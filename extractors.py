@@ -0,0 +1,226 @@
+# registry of the fields of a product page
+# every output column is a registered field with its selector, how its raw text
+# is read (in-page script or lxml) and its post-processing. a run picks the
+# fields it needs and only those are read from the page, in a single webdriver
+# round trip (or one lxml pass for the http engine), so every scraper produces
+# the same schema for the same selection
+
+import json
+
+CAPTCHA_TEXT = "Enter the characters you see below"
+
+
+class Field:
+    """
+    One column of the scraping results.
+
+    Parameters:
+        name (str): Name of the output column.
+        selector (str): CSS selector of the element, the first match is read.
+        read (str): How the raw text is read: "text" (single line), "table" (one line per row,
+            cells separated by a space), "list" (one line per item) or "attribute".
+        attribute (str): Name of the attribute read when `read` is "attribute".
+        post (callable): Turns the raw text (None if the element is missing) into the column value.
+    """
+
+    def __init__(self, name, selector, read="text", attribute=None, post=None):
+        self.name = name
+        self.selector = selector
+        self.read = read
+        self.attribute = attribute
+        self.post = post if post is not None else (lambda raw: raw or "")
+
+
+FIELDS = {}
+
+
+def register(field):
+    FIELDS[field.name] = field
+    return field
+
+
+def _brand(table):
+    try:
+        return table.split('Brand ')[1].split('\n')[0]
+    except (AttributeError, IndexError):
+        return ""
+
+
+def _categories(categories):
+    if categories is None:
+        # not all product have categories, ex: https://www.amazon.com/dp/B001EO5TPM
+        return ""
+    # every other line is the "›" separator
+    return categories.split("\n")[::2]
+
+
+register(Field("ProductTitle", "#productTitle"))
+register(Field("ProductBylineInfo", "#bylineInfo"))
+register(Field("ProductBrandFromTable", "table", read="table", post=_brand))
+register(Field("ProductCategories", ".a-subheader", read="list", post=_categories))
+# not all product have description
+register(Field("ProductDesc", "#productDescription"))
+register(Field("ProductImg", "#imgTagWrapperId img", read="attribute", attribute="src"))
+
+# columns of a regular run
+DEFAULT_FIELDS = ("ProductTitle", "ProductBylineInfo", "ProductBrandFromTable", "ProductCategories")
+
+
+def select_fields(fields=DEFAULT_FIELDS):
+    # validated tuple of field names, ex: from the config of a run
+    # the title is always read, it tells a scraped page from a failed one
+    fields = tuple(fields)
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields {unknown}, expected some of {tuple(FIELDS)}")
+    if "ProductTitle" not in fields:
+        fields = ("ProductTitle",) + fields
+    return fields
+
+
+## IN-PAGE SCRIPT
+
+# text is collapsed into a single line per element, tables are one line per
+# row with cells separated by a space, lists are one line per item
+SCRIPT_HELPERS = """
+const collapse = (value) => value.replace(/\\s+/g, " ").trim();
+const text = (el) => el ? collapse(el.innerText) : null;
+
+const tableText = (table) => table ? Array.from(table.rows)
+    .map((row) => Array.from(row.cells).map(text).filter(Boolean).join(" "))
+    .filter(Boolean)
+    .join("\\n") : null;
+
+const listText = (list) => {
+    if (!list) return null;
+    const items = Array.from(list.querySelectorAll("li")).map(text).filter(Boolean);
+    return items.length ? items.join("\\n") : text(list);
+};
+
+const attribute = (el, name) => el ? el.getAttribute(name) : null;
+"""
+
+SCRIPT_READERS = {
+    "text": "text({el})",
+    "table": "tableText({el})",
+    "list": "listText({el})",
+    "attribute": "attribute({el}, {attribute})",
+}
+
+_scripts = {}
+
+
+def build_script(fields=DEFAULT_FIELDS):
+    # script returning the raw text of every selected field, built once per selection
+    fields = select_fields(fields)
+    if fields not in _scripts:
+        entries = [
+            "documentTitle: document.title,",
+            f'captcha: text(document.querySelector("h4")) === {json.dumps(CAPTCHA_TEXT)},',
+        ]
+        for name in fields:
+            field = FIELDS[name]
+            el = f"document.querySelector({json.dumps(field.selector)})"
+            entries.append(f"{json.dumps(name)}: " + SCRIPT_READERS[field.read].format(el=el, attribute=json.dumps(field.attribute)) + ",")
+        _scripts[fields] = SCRIPT_HELPERS + "\nreturn {\n" + "\n".join(f"    {entry}" for entry in entries) + "\n};\n"
+    return _scripts[fields]
+
+
+async def extract_raw(session, fields=DEFAULT_FIELDS):
+    return await session.execute_script(build_script(fields))
+
+
+## LXML
+
+def _line_text(el):
+    # single line of visible text, similar to webdriver's get_text
+    return " ".join(el.text_content().split())
+
+
+def _first(tree, selector):
+    found = tree.cssselect(selector)
+    return found[0] if found else None
+
+
+def _table_text(table_el):
+    # one line per row, cells separated by a space, like the rendered table
+    lines = []
+    for row_el in table_el.iter("tr"):
+        cells = [_line_text(cell_el) for cell_el in row_el if cell_el.tag in ("td", "th")]
+        line = " ".join(cell for cell in cells if cell)
+        if line:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def _list_text(list_el):
+    # one line per list item, ex: "Grocery & Gourmet Food\n›\nSnack Foods"
+    lines = [_line_text(item_el) for item_el in list_el.iter("li")]
+    lines = [line for line in lines if line]
+    return "\n".join(lines) if lines else _line_text(list_el)
+
+
+HTML_READERS = {
+    "text": lambda el, field: _line_text(el),
+    "table": lambda el, field: _table_text(el),
+    "list": lambda el, field: _list_text(el),
+    "attribute": lambda el, field: el.get(field.attribute),
+}
+
+
+def is_captcha_page(tree):
+    h4_el = _first(tree, "h4")
+    return h4_el is not None and _line_text(h4_el) == CAPTCHA_TEXT
+
+
+def read_tree(tree, fields=DEFAULT_FIELDS):
+    # same raw texts as the in-page script, from an lxml tree
+    title_el = _first(tree, "title")
+    raw = {
+        "documentTitle": _line_text(title_el) if title_el is not None else "",
+        "captcha": is_captcha_page(tree),
+    }
+    for name in select_fields(fields):
+        field = FIELDS[name]
+        el = _first(tree, field.selector)
+        raw[name] = HTML_READERS[field.read](el, field) if el is not None else None
+    return raw
+
+
+## RESULT
+
+def build_result(url, raw, fields=DEFAULT_FIELDS):
+    # skip scraping process if page not found, ex: https://www.amazon.com/dp/B004N5KULM
+    if raw["documentTitle"] == "Page Not Found":
+        return {
+            "ProductURL": url,
+            "ProductTitle": raw["documentTitle"],
+        }
+
+    result = {"ProductURL": url}
+    for name in select_fields(fields):
+        result[name] = FIELDS[name].post(raw.get(name))
+    return result
+
+
+# outcome of a scraped page, shared by the rate limiter, the journal, the queue and the registry
+OUTCOMES = ("ok", "captcha", "not_found", "error")
+
+
+def classify(result):
+    # outcome of a scraped page, from the result dict (None: blocked / captcha)
+    if result is None:
+        return "captcha"
+    if result.get("ProductTitle") == "Page Not Found":
+        return "not_found"
+    if "ProductTitle" not in result:
+        return "error"
+    if not result["ProductTitle"]:
+        # every real product has a title, an empty one means we were served a captcha
+        return "captcha"
+    return "ok"
+
+
+def is_done(result):
+    # scraped for good, anything else (failed page, captcha, blank title) is scraped again
+    return classify(result) in ("ok", "not_found")
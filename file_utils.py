@@ -0,0 +1,16 @@
+# helpers to write files safely
+
+import json
+import os
+
+
+def write_json_atomic(path, data):
+    # write to a temporary file first, an interrupted save never corrupts the file
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
@@ -0,0 +1,100 @@
+# fetch product pages over plain http and parse them with lxml
+# every field we read is part of the server-rendered html, so most pages don't
+# need a browser at all. pages that can't be handled here (captcha, blocked
+# requests, network errors) return None and should go through the browser.
+
+import random
+
+# scraping
+import aiohttp  # async http client
+from lxml import etree, html as lxml_html  # fast html parser
+
+from extractors import DEFAULT_FIELDS, build_result, classify, is_captcha_page, read_tree  # field registry
+from metrics import span  # per-stage timing
+
+
+DEFAULT_HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36'
+
+
+def parse_product_html(url, page_html, fields=DEFAULT_FIELDS):
+    """
+    Parse a product page into the same dict as the browser scrapers.
+
+    Returns None if the page is not a product page we can read (ex: captcha, empty body, no title).
+    """
+    try:
+        tree = lxml_html.fromstring(page_html)
+    except (etree.ParserError, ValueError):
+        # ex: "Document is empty"
+        return None
+
+    if is_captcha_page(tree):
+        return None
+
+    # same raw texts as the in-page extraction script
+    result = build_result(url, read_tree(tree, fields), fields)
+
+    # a product page without title is a block page the browser has to handle, never cached
+    if classify(result) not in ("ok", "not_found"):
+        return None
+    return result
+
+
+class HttpFetcher:
+    """
+    Pooled async http client for product pages.
+
+    Parameters:
+        concurrency (int): Maximum number of open connections.
+        user_agent_list (list): If given, every request picks a random user agent from it.
+        timeout (int): Total timeout of a single request in seconds.
+    """
+
+    def __init__(self, concurrency=20, user_agent_list=None, timeout=30):
+        self.concurrency = concurrency
+        self.user_agent_list = user_agent_list
+        self.timeout = timeout
+        self.client = None
+
+    async def __aenter__(self):
+        self.client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers=DEFAULT_HEADERS,
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.client.close()
+
+    async def fetch(self, url):
+        user_agent_string = DEFAULT_USER_AGENT
+        if self.user_agent_list:
+            user_agent_string = random.choice(self.user_agent_list)
+
+        async with self.client.get(url, headers={"User-Agent": user_agent_string}) as response:
+            return response.status, await response.text()
+
+
+async def extract_page_http(fetcher, url, cache=None, fields=DEFAULT_FIELDS):
+    # None means the browser has to take over this page
+    try:
+        with span("fetch"):
+            status, page_html = await fetcher.fetch(url)
+    except Exception:
+        return None
+
+    # amazon answers "Page Not Found" with 404, anything else non-200 is a block
+    if status not in (200, 404):
+        return None
+
+    with span("parse"):
+        result = parse_product_html(url, page_html, fields)
+    if result is not None and cache is not None:
+        cache.put(url, page_html)
+    return result
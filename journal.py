@@ -0,0 +1,141 @@
+# crash-safe, append-only journal of scraping results
+# every finished page is appended as one json line and flushed to disk in
+# small batches, so a crash loses at most one batch and a restarted run can
+# skip the urls that are already done
+
+import json
+import os
+from itertools import groupby
+
+import pandas as pd
+
+from extractors import is_done as is_scraped
+
+
+def read_positioned(path):
+    # (offset of the line, record), a crash in the middle of a write can leave a truncated last line
+    if not os.path.exists(path):
+        return
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            start, offset = offset, offset + len(line)
+            try:
+                yield start, json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def read_records(path):
+    for _, record in read_positioned(path):
+        yield record
+
+
+def latest_records(paths, key="ProductURL", is_done=is_scraped):
+    """
+    Read one or more journals, keeping the last record per key.
+    A record that is not done (ex: failed page) never replaces one that is.
+    """
+    records = {}
+    for path in paths:
+        for record in read_records(path):
+            if is_done(record) or record[key] not in records:
+                records[record[key]] = record
+    return list(records.values())
+
+
+def iter_latest_records(paths, key="ProductURL", is_done=is_scraped):
+    """
+    Same records as `latest_records`, streamed in journal order: the first pass only keeps
+    the position of the record kept for every key, the second one reads them back one by one.
+    """
+    paths = list(paths)
+    kept = {}
+    for index, path in enumerate(paths):
+        for offset, record in read_positioned(path):
+            if is_done(record) or record[key] not in kept:
+                kept[record[key]] = (index, offset)
+
+    for index, positions in groupby(sorted(kept.values()), key=lambda position: position[0]):
+        with open(paths[index], "rb") as f:
+            for _, offset in positions:
+                f.seek(offset)
+                yield json.loads(f.readline())
+
+
+def load_journals(paths, key="ProductURL", is_done=is_scraped):
+    return pd.DataFrame(latest_records(paths, key, is_done))
+
+
+class ResultJournal:
+    """
+    Append-only JSONL journal of results.
+
+    Parameters:
+        path (str): Path of the journal file, created if it doesn't exist.
+        key (str): Field identifying a record, used to skip finished work on restart.
+        flush_every (int): Number of records buffered before they are written and fsynced.
+        is_done (callable): Tells a finished record from one to redo, defaults to scraped product pages
+            (a product or "Page Not Found", not a failed page or a captcha).
+    """
+
+    def __init__(self, path, key="ProductURL", flush_every=50, is_done=is_scraped):
+        self.path = path
+        self.key = key
+        self.flush_every = flush_every
+        self.is_done = is_done
+        self._buffer = []
+        self._file = None
+
+    def __enter__(self):
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+        # start on a fresh line if the last run crashed mid-write
+        if self._file.tell() > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def completed(self):
+        return {
+            record[self.key]
+            for record in read_records(self.path)
+            if self.is_done(record)
+        }
+
+    def append(self, record):
+        self._buffer.append(json.dumps(record, ensure_ascii=False))
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        self._file.write("\n".join(self._buffer) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer = []
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def records(self):
+        return latest_records([self.path], self.key, self.is_done)
+
+    def iter_records(self):
+        # same as `records`, without holding every record in memory
+        return iter_latest_records([self.path], self.key, self.is_done)
+
+    def to_frame(self):
+        return load_journals([self.path], self.key, self.is_done)
@@ -0,0 +1,198 @@
+# per-stage timing, page counters and gauges of a scraping run
+# every stage of a page (browser launch, navigation, captcha, extraction, write)
+# is timed as a span, logged through structlog and aggregated into histograms,
+# readable as prometheus text (optionally served over http) or a json summary
+# gauges hold the latest value of a state, ex: the request rate of the limiter
+#
+# spans are logged at debug level to the "metrics" logger, ex:
+#   logging.basicConfig(); logging.getLogger("metrics").setLevel(logging.DEBUG)
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import structlog
+
+# measure computation time
+from timeit import default_timer as timer
+
+
+LOGGER_NAME = "metrics"
+
+# seconds, from a fast lxml parse to a slow browser launch
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # linear interpolation inside the bucket holding the quantile, like prometheus
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets + (self.max,), self.counts):
+            if count and seen + count >= rank:
+                return lower + (min(bound, self.max) - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "mean": round(self.sum / self.count, 3) if self.count else None,
+            "p50": round(self.quantile(0.5), 3) if self.count else None,
+            "p95": round(self.quantile(0.95), 3) if self.count else None,
+            "max": round(self.max, 3),
+        }
+
+
+class Metrics:
+    """
+    Stage histograms, counters and gauges of one process.
+
+    Parameters:
+        prefix (str): Prefix of the prometheus metric names.
+    """
+
+    def __init__(self, prefix="scraper"):
+        self.prefix = prefix
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    @contextmanager
+    def span(self, stage, **fields):
+        # also usable around awaits, the time of other tasks in between is part of the span
+        start = timer()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            seconds = timer() - start
+            self.observe(stage, seconds)
+            if failed:
+                self.inc("stage_errors_total", stage=stage)
+
+            logger = logging.getLogger(LOGGER_NAME)
+            if logger.isEnabledFor(logging.DEBUG):
+                structlog.get_logger(LOGGER_NAME).debug("span", stage=stage, seconds=round(seconds, 4), failed=failed, **fields)
+
+    def summary(self):
+        def flat(values):
+            # name{label=value,...} -> value
+            flat_values = {}
+            for (name, labels), value in sorted(values.items()):
+                label_text = ",".join(f"{key}={value}" for key, value in labels)
+                flat_values[f"{name}{{{label_text}}}" if labels else name] = value
+            return flat_values
+
+        with self._lock:
+            return {
+                "stages": {stage: histogram.summary() for stage, histogram in sorted(self.stages.items())},
+                "counters": flat(self.counters),
+                "gauges": flat(self.gauges),
+            }
+
+    def write_summary(self, path):
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def render_prometheus(self):
+        name = f"{self.prefix}_stage_seconds"
+        lines = [f"# HELP {name} Time spent per stage of a page.", f"# TYPE {name} histogram"]
+        with self._lock:
+            for stage, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+
+            typed = set()
+            for kind, values in (("counter", self.counters), ("gauge", self.gauges)):
+                for (metric, labels), value in sorted(values.items()):
+                    full_name = f"{self.prefix}_{metric}"
+                    if full_name not in typed:
+                        lines.append(f"# TYPE {full_name} {kind}")
+                        typed.add(full_name)
+                    label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+                    lines.append(f"{full_name}{{{label_text}}} {value}" if labels else f"{full_name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9100, host="0.0.0.0"):
+        """
+        Serve the prometheus text on http://host:port/metrics from a background thread, returns the server.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # no access log on stderr for every scrape
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# metrics of this process, shared by every module of the scraper
+METRICS = Metrics()
+span = METRICS.span
+inc = METRICS.inc
+gauge = METRICS.set_gauge
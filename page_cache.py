@@ -0,0 +1,166 @@
+# persistent on-disk cache of raw product page html
+# pages are stored compressed, one file per page, and indexed in sqlite so
+# expired pages and least recently used pages can be evicted cheaply
+
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+
+from url_utils import extract_asin, normalize_url
+
+
+def cache_key(url):
+    # same product, same key: the asin if the url has one, else a hash of the url
+    asin = extract_asin(url)
+    if asin is not None:
+        return asin
+    return hashlib.sha1(normalize_url(url).encode("utf-8")).hexdigest()
+
+
+class PageCache:
+    """
+    Compressed html cache keyed by ASIN / normalized ProductURL.
+
+    Parameters:
+        folder (str): Directory holding the cached pages and the sqlite index.
+        ttl (int): Number of seconds a cached page stays valid. None means forever.
+        max_bytes (int): Total size of the compressed pages, older pages are evicted above it.
+        evict_every (int): Number of pages written between two sweeps of the expired pages.
+    """
+
+    def __init__(self, folder="cache/pages", ttl=30 * 24 * 3600, max_bytes=2 * 1024**3, evict_every=1000):
+        self.folder = folder
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self._puts = 0
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.conn = sqlite3.connect(os.path.join(folder, "index.sqlite"))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS pages_fetched_at ON pages (fetched_at)")
+        self.conn.commit()
+
+        # running size of the cache, summed once instead of on every write
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.html.z")
+
+    def _is_expired(self, fetched_at, now):
+        return self.ttl is not None and now - fetched_at > self.ttl
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return zlib.decompress(f.read()).decode("utf-8")
+        except (OSError, zlib.error):
+            return None
+
+    def _size(self, key):
+        row = self.conn.execute("SELECT size FROM pages WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def _delete(self, key):
+        self.total_bytes -= self._size(key)
+        self.conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def get(self, url):
+        key = cache_key(url)
+        row = self.conn.execute("SELECT fetched_at FROM pages WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        now = time.time()
+        if self._is_expired(row[0], now):
+            self._delete(key)
+            self.conn.commit()
+            return None
+
+        page_html = self._read(key)
+        if page_html is None:
+            # the file is gone or corrupted, forget about it
+            self._delete(key)
+        else:
+            self.conn.execute("UPDATE pages SET accessed_at = ? WHERE key = ?", (now, key))
+        self.conn.commit()
+        return page_html
+
+    def put(self, url, page_html):
+        key = cache_key(url)
+        data = zlib.compress(page_html.encode("utf-8"), 6)
+
+        # write to a temporary file first so readers never see half a page
+        path = self._path(key)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+
+        now = time.time()
+        self.total_bytes += len(data) - self._size(key)
+        self.conn.execute(
+            """
+            INSERT INTO pages (key, url, size, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                url = excluded.url, size = excluded.size,
+                fetched_at = excluded.fetched_at, accessed_at = excluded.accessed_at
+            """,
+            (key, url, len(data), now, now),
+        )
+        self.conn.commit()
+
+        # the size check is free, the sweep of expired pages only runs every `evict_every` pages
+        self._puts += 1
+        over_cap = self.max_bytes is not None and self.total_bytes > self.max_bytes
+        if over_cap or self._puts % self.evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        # expired pages first
+        if self.ttl is not None:
+            expired = self.conn.execute(
+                "SELECT key FROM pages WHERE fetched_at < ?", (time.time() - self.ttl,)
+            ).fetchall()
+            for (key,) in expired:
+                self._delete(key)
+
+        # then least recently used pages until the cache fits
+        if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+            for (key,) in self.conn.execute("SELECT key FROM pages ORDER BY accessed_at").fetchall():
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self._delete(key)
+        self.conn.commit()
+
+    def iter_pages(self):
+        # (url, html) of every valid page, used to re-run parsing without the network
+        now = time.time()
+        for key, url, fetched_at in self.conn.execute("SELECT key, url, fetched_at FROM pages").fetchall():
+            if self._is_expired(fetched_at, now):
+                continue
+            page_html = self._read(key)
+            if page_html is not None:
+                yield url, page_html
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,189 @@
+# disposable chrome profiles (--user-data-dir), one per browser session
+# every launched browser gets a fresh folder under a single root (tmpfs when
+# available), removed in a background thread when its session is retired, so
+# temp files never pile up and no cleanup ever blocks the event loop
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+# measure computation time
+from timeit import default_timer as timer
+
+
+PREFIX = "profile-"
+OWNER_FILE = "owner.pid"
+
+
+def default_root():
+    # tmpfs keeps chrome's profile writes off the disk
+    base = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+    return os.path.join(base, "scrape-amazon-profiles")
+
+
+def folder_size(path):
+    size = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                # chrome removes its temporary files all the time
+                pass
+    return size
+
+
+def remove_folder(path):
+    # size freed, measured just before the folder goes
+    size = folder_size(path)
+    shutil.rmtree(path, ignore_errors=True)
+    return size
+
+
+def _owner_alive(path):
+    try:
+        with open(os.path.join(path, OWNER_FILE)) as f:
+            pid = int(f.read())
+    except (OSError, ValueError):
+        return False
+    if os.name != "posix":
+        # no cheap check without killing the process, rely on the age of the profile
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _age(path):
+    # seconds since the profile was created
+    try:
+        return time.time() - os.path.getmtime(os.path.join(path, OWNER_FILE))
+    except OSError:
+        return float("inf")
+
+
+def _folder_age(path):
+    try:
+        return time.time() - os.path.getmtime(path)
+    except OSError:
+        return float("inf")
+
+
+class ProfileDirs:
+    """
+    Per-session chrome profile folders under one root, with background cleanup and a disk cap.
+
+    Parameters:
+        root (str): Folder holding the profiles, defaults to a folder in /dev/shm (or the temp folder).
+        max_bytes (int): Size of the root above which `over_cap` asks for sessions to be recycled.
+        check_every (float): Seconds between two measures of the root size, each made in a thread.
+        resume_ratio (float): Once over the cap, sessions are recycled until the root is back
+            under `resume_ratio * max_bytes`.
+    """
+
+    def __init__(self, root=None, max_bytes=2 * 1024 ** 3, check_every=30.0, resume_ratio=0.8):
+        self.root = root or default_root()
+        self.max_bytes = max_bytes
+        self.check_every = check_every
+        self.resume_ratio = resume_ratio
+        self.active = set()
+        self._cleanups = set()
+        self._size = 0
+        self._recycling = False
+        self._checked_at = None
+        self._measure = None
+
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+    def create(self):
+        path = tempfile.mkdtemp(prefix=PREFIX, dir=self.root)
+        # lets a sweep from another process tell live profiles from leftovers
+        with open(os.path.join(path, OWNER_FILE), "w") as f:
+            f.write(str(os.getpid()))
+        self.active.add(path)
+        return path
+
+    def release(self, path):
+        # removed in a thread, the caller doesn't wait for it
+        if path is None:
+            return
+        self.active.discard(path)
+        task = asyncio.ensure_future(asyncio.to_thread(remove_folder, path))
+        self._cleanups.add(task)
+        task.add_done_callback(self._removed)
+
+    def _removed(self, task):
+        # the freed space counts right away, without waiting for the next measure
+        self._cleanups.discard(task)
+        if not task.cancelled() and task.exception() is None:
+            self._size = max(self._size - task.result(), 0)
+
+    async def wait(self):
+        # let the pending cleanups (and size measure) finish, ex: before the event loop closes
+        pending = list(self._cleanups) + ([self._measure] if self._measure is not None else [])
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def over_cap(self):
+        # compares the last measured size, never blocks the event loop
+        # walking the tree is not free, a new measure starts in a thread at most every `check_every` seconds
+        now = timer()
+        if self._measure is None and (self._checked_at is None or now - self._checked_at >= self.check_every):
+            self._checked_at = now
+            self._measure = asyncio.ensure_future(asyncio.to_thread(folder_size, self.root))
+            self._measure.add_done_callback(self._measured)
+
+        # recycling starts above the cap and goes on until the root is well under it,
+        # so the pool doesn't flap around the cap
+        if self._size > self.max_bytes:
+            self._recycling = True
+        elif self._size < self.resume_ratio * self.max_bytes:
+            self._recycling = False
+        # one profile at a time: the next one waits until the space of the last one is freed
+        return self._recycling and not self._cleanups
+
+    def _measured(self, task):
+        self._measure = None
+        if not task.cancelled() and task.exception() is None:
+            self._size = task.result()
+
+    def sweep(self, max_age=None, grace=60.0):
+        """
+        Remove the profiles left behind by crashed runs, returns the number of folders removed.
+        Profiles of running sessions (of any process) are kept, unless older than `max_age` seconds.
+        Profiles without an owner file yet are kept for `grace` seconds, another process may be creating them.
+        """
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.startswith(PREFIX) or path in self.active:
+                continue
+
+            # between mkdtemp and the owner file, a new profile looks like a leftover
+            if not os.path.exists(os.path.join(path, OWNER_FILE)) and _folder_age(path) < grace:
+                continue
+
+            # a profile of this process that is not active anymore is a leftover too
+            alive = _owner_alive(path) and not self._owned(path)
+            too_old = max_age is not None and _age(path) > max_age
+            if alive and not too_old:
+                continue
+
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        return removed
+
+    @staticmethod
+    def _owned(path):
+        try:
+            with open(os.path.join(path, OWNER_FILE)) as f:
+                return int(f.read()) == os.getpid()
+        except (OSError, ValueError):
+            return False
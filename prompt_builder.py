@@ -0,0 +1,106 @@
+# build one prediction prompt per product from its most helpful reviews
+# reviews are ranked and cut to the top k per product in a vectorized way,
+# every text is tokenized once (in bulk, on several threads) and its token
+# count cached by text hash, then each prompt is filled up to the token budget
+
+import json
+import os
+from hashlib import blake2b
+
+import numpy as np
+
+from file_utils import write_json_atomic  # crash-safe cache
+
+
+SEPARATOR = "\n"
+
+
+def _text_key(text):
+    return blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class TokenCounter:
+    """
+    Token counts of texts, cached by text hash.
+
+    Parameters:
+        encoding (tiktoken.Encoding): Tokenizer of the model, ex: tiktoken.encoding_for_model("text-embedding-ada-002").
+        num_threads (int): Number of threads used by `encode_batch`.
+        cache_path (str): If given, json file where the counts are kept between runs.
+    """
+
+    def __init__(self, encoding, num_threads=8, cache_path=None):
+        self.encoding = encoding
+        self.num_threads = num_threads
+        self.cache_path = cache_path
+        self.counts = {}
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, encoding="utf-8") as f:
+                self.counts = json.load(f)
+
+    def count(self, texts):
+        """
+        Returns the number of tokens of every text (numpy array), only encoding the texts never seen before.
+        """
+        keys = [_text_key(text) for text in texts]
+        unseen = {}
+        for key, text in zip(keys, texts):
+            if key not in self.counts:
+                unseen[key] = text
+
+        if unseen:
+            tokens = self.encoding.encode_batch(list(unseen.values()), num_threads=self.num_threads)
+            self.counts.update(zip(unseen, map(len, tokens)))
+            self.save()
+
+        return np.array([self.counts[key] for key in keys], dtype=int)
+
+    def truncate(self, text, max_tokens):
+        return self.encoding.decode(self.encoding.encode(text)[:max_tokens])
+
+    def save(self):
+        if self.cache_path is not None:
+            write_json_atomic(self.cache_path, self.counts)
+
+
+def top_reviews(reviews, k=3, key="ProductURL"):
+    # most helpful reviews first, at most k per product
+    helpfulness = reviews["HelpfulnessNumerator"] / reviews["HelpfulnessDenominator"].replace(0, np.nan)
+    order = helpfulness.sort_values(ascending=False, kind="mergesort").index
+    return reviews.loc[order].groupby(key, sort=False).head(k)
+
+
+def build_prompts(reviews, counter, k=3, max_tokens=1900, key="ProductURL", text="Text"):
+    """
+    One prompt per product: its top k reviews by helpfulness, joined until the token budget is used.
+
+    Parameters:
+        reviews (pd.DataFrame): Reviews with `key`, `text`, "HelpfulnessNumerator" and "HelpfulnessDenominator" columns.
+        counter (TokenCounter): Token counter of the prediction model.
+        k (int): Maximum number of reviews per product.
+        max_tokens (int): Token budget of a prompt. The review that doesn't fit is cut to the remaining budget.
+        key (str): Column identifying a product.
+        text (str): Column holding the review text.
+
+    Returns a dataframe with `key`, `text` (the prompt) and "Tokens" columns, in order of the best review.
+    """
+    top = top_reviews(reviews[reviews[text].notna()], k, key)
+    top = top[[key, text]].reset_index(drop=True)
+
+    # tokens used by the prompt before and after every review, separators included
+    tokens = counter.count(top[text].tolist())
+    separators = int(counter.count([SEPARATOR])[0]) * (top.groupby(key, sort=False).cumcount() > 0).to_numpy()
+    top["Tokens"] = tokens + separators
+    used_after = top.groupby(key, sort=False)["Tokens"].cumsum().to_numpy()
+    used_before = used_after - top["Tokens"].to_numpy()
+
+    # whole reviews that fit, plus the first one that doesn't, cut to what is left
+    fits = used_after <= max_tokens
+    remaining = max_tokens - used_before - separators
+    cut = ~fits & (remaining > 0)
+    for i in np.flatnonzero(cut):
+        top.loc[i, text] = counter.truncate(top.loc[i, text], int(remaining[i]))
+        top.loc[i, "Tokens"] = int(remaining[i] + separators[i])
+    top = top[fits | cut]
+
+    return top.groupby(key, sort=False).agg({text: SEPARATOR.join, "Tokens": "sum"}).reset_index()
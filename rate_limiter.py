@@ -0,0 +1,118 @@
+# adaptive request rate shared by every concurrent session
+# token bucket whose rate grows slowly while pages come back clean and is cut
+# in half when captcha or "Page Not Found" pages start piling up (AIMD)
+
+import asyncio
+from collections import deque
+
+from extractors import OUTCOMES  # outcome of a page
+from metrics import inc, gauge  # exported to the run summary and prometheus
+
+# measure computation time
+from timeit import default_timer as timer
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket with additive increase / multiplicative decrease of its rate.
+
+    Parameters:
+        rate (float): Initial number of pages per second.
+        min_rate (float): Lowest rate the limiter backs off to.
+        max_rate (float): Highest rate the limiter grows to.
+        increase (float): Pages per second added after every clean page.
+        decrease (float): Factor applied to the rate when captcha / not found pages spike.
+        window (int): Number of recent pages used to compute the captcha and not found rates.
+        min_samples (int): Number of pages in the window needed before backing off.
+        captcha_threshold (float): Captcha rate in the window that triggers a back off.
+        not_found_threshold (float): "Page Not Found" rate in the window that triggers a back off.
+    """
+
+    def __init__(
+        self,
+        rate=1.0,
+        min_rate=0.05,
+        max_rate=5.0,
+        increase=0.02,
+        decrease=0.5,
+        window=50,
+        min_samples=10,
+        captcha_threshold=0.1,
+        not_found_threshold=0.5,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.min_samples = min_samples
+        self.captcha_threshold = captcha_threshold
+        self.not_found_threshold = not_found_threshold
+
+        self.tokens = 1.0
+        self.updated_at = timer()
+        self.recent = deque(maxlen=window)
+        self.counts = {outcome: 0 for outcome in OUTCOMES}
+        self.latency = None
+        self.backoffs = 0
+        self._lock = None
+
+    def _refill(self):
+        now = timer()
+        # bucket holds at most one second worth of pages
+        self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        # the lock is created here so it belongs to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def _share(self, outcome):
+        if not self.recent:
+            return 0.0
+        return sum(1 for recent in self.recent if recent == outcome) / len(self.recent)
+
+    def record(self, outcome, latency=None):
+        self.counts[outcome] += 1
+        self.recent.append(outcome)
+        inc("rate_limiter_pages_total", outcome=outcome)
+
+        if latency is not None:
+            # exponentially weighted moving average
+            self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+
+        spiking = self._share("captcha") > self.captcha_threshold or self._share("not_found") > self.not_found_threshold
+        if len(self.recent) >= self.min_samples and spiking:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0.0)
+            self.backoffs += 1
+            inc("rate_limiter_backoffs_total")
+            # start over, otherwise the same pages would trigger the back off again
+            self.recent.clear()
+        elif outcome == "ok":
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+        gauge("rate_limiter_rate", self.rate)
+        gauge("rate_limiter_captcha_share", self._share("captcha"))
+        gauge("rate_limiter_not_found_share", self._share("not_found"))
+        if self.latency is not None:
+            gauge("rate_limiter_latency_seconds", self.latency)
+
+    def metrics(self):
+        return {
+            "rate": round(self.rate, 3),
+            "captcha_rate": round(self._share("captcha"), 3),
+            "not_found_rate": round(self._share("not_found"), 3),
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "backoffs": self.backoffs,
+            **self.counts,
+        }
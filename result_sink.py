@@ -0,0 +1,92 @@
+# columnar output of scraping results
+# records are written to parquet in typed arrow batches, with the categories as
+# a native list column instead of the python list repr stored in the csv files
+
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from extractors import DEFAULT_FIELDS, select_fields  # field registry
+
+
+# arrow type of every registered field, text unless listed here
+FIELD_TYPES = {
+    "ProductCategories": pa.list_(pa.string()),
+}
+
+
+def result_schema(fields=DEFAULT_FIELDS):
+    # columns of a run scraping `fields`
+    return pa.schema([("ProductURL", pa.string())] + [(name, FIELD_TYPES.get(name, pa.string())) for name in select_fields(fields)])
+
+
+RESULT_SCHEMA = result_schema()
+
+
+def _is_missing(value):
+    # NaN of a dataframe row, or "" for a field the page doesn't have (ex: no byline)
+    return value is None or value == "" or (isinstance(value, float) and value != value)
+
+
+def _normalize(record, schema):
+    # missing values become nulls, like the csv round trip, so fillna works on both formats
+    row = {name: None if _is_missing(record.get(name)) else record.get(name) for name in schema.names}
+
+    # products without categories are stored as "" by the scrapers
+    categories = row.get("ProductCategories")
+    if "ProductCategories" in row and not isinstance(categories, list):
+        row["ProductCategories"] = None
+    return row
+
+
+class ParquetSink:
+    """
+    Incremental parquet writer for result dicts.
+
+    Parameters:
+        path (str): Path of the parquet file to write.
+        batch_size (int): Number of records per arrow record batch (row group).
+        schema (pyarrow.Schema): Columns of the file, fields missing from a record are null.
+    """
+
+    def __init__(self, path, batch_size=1000, schema=RESULT_SCHEMA):
+        self.path = path
+        self.batch_size = batch_size
+        self.schema = schema
+        self._buffer = []
+        self._writer = None
+
+    def __enter__(self):
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self._writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def append(self, record):
+        self._buffer.append(_normalize(record, self.schema))
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        batch = pa.RecordBatch.from_pylist(self._buffer, schema=self.schema)
+        self._writer.write_batch(batch)
+        self._buffer = []
+
+    def close(self):
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+            self._writer = None
+
+
+def write_parquet(records, path, batch_size=1000, schema=RESULT_SCHEMA):
+    with ParquetSink(path, batch_size, schema) as sink:
+        for record in records:
+            sink.append(record)
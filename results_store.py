@@ -0,0 +1,211 @@
+# persistent store of the combined scraping results, keyed by ProductURL
+# a manifest remembers which result files were merged already (path, size,
+# mtime and hash), so combining only reads the files that are new or changed
+
+import ast
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from extractors import FIELDS  # field registry
+
+
+# every registered field, whatever the fields selected by the run that wrote a file
+RESULT_COLUMNS = ["ProductURL"] + list(FIELDS)
+
+# "" from an older store counts as missing too
+MISSING_TITLE = "(ProductTitle IS NULL OR ProductTitle = '')"
+
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def read_results(path):
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    return df.reindex(columns=RESULT_COLUMNS)
+
+
+def _categories_json(value):
+    # native list (parquet) or its python repr (csv) -> json array, anything else is missing
+    if isinstance(value, str):
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return None
+    if not isinstance(value, (list, tuple, np.ndarray)) or len(value) == 0:
+        return None
+    return json.dumps([str(item) for item in value], ensure_ascii=False)
+
+
+def _to_rows(df):
+    df = df.reindex(columns=RESULT_COLUMNS).drop_duplicates("ProductURL", keep="last")
+    df = df.astype(object)
+
+    # categories are stored as json arrays, each distinct repr string is parsed once
+    categories = df["ProductCategories"]
+    is_string = categories.map(lambda x: isinstance(x, str))
+    parsed = {value: _categories_json(value) for value in categories[is_string].unique()}
+    df["ProductCategories"] = [parsed[x] if isinstance(x, str) else _categories_json(x) for x in categories]
+
+    # "" is a field the page doesn't have, stored as NULL so it never erases a scraped value
+    df = df.where(df.notna() & (df != ""), None)
+    return df.itertuples(index=False, name=None)
+
+
+def _categories_list(value):
+    return json.loads(value) if value is not None else None
+
+
+class ResultsStore:
+    """
+    SQLite store of scraping results with ProductURL as primary key.
+
+    Parameters:
+        path (str): Path of the sqlite file, created if it doesn't exist.
+    """
+
+    def __init__(self, path="results/combined/scrap_results.sqlite"):
+        self.path = path
+
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS results (
+                ProductURL TEXT PRIMARY KEY,
+                {", ".join(f"{column} TEXT" for column in RESULT_COLUMNS[1:])}
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS manifest (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                sha1 TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                merged_at TEXT NOT NULL
+            )
+            """
+        )
+        # fields registered after the store was created
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(results)")}
+        for column in RESULT_COLUMNS[1:]:
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE results ADD COLUMN {column} TEXT")
+
+        self._migrate()
+
+        # rows still missing their title, keeps "what is left to scrape" cheap
+        self.conn.execute(f"CREATE INDEX IF NOT EXISTS results_untitled ON results (ProductURL) WHERE {MISSING_TITLE}")
+        self.conn.commit()
+
+    def _migrate(self):
+        # stores written before "" meant NULL and categories were json arrays
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= 1:
+            return
+        with self.conn:
+            self.conn.execute("DROP INDEX IF EXISTS results_missing")
+            for column in RESULT_COLUMNS[1:]:
+                self.conn.execute(f"UPDATE results SET {column} = NULL WHERE {column} = ''")
+            rows = self.conn.execute("SELECT ProductURL, ProductCategories FROM results WHERE ProductCategories IS NOT NULL").fetchall()
+            self.conn.executemany(
+                "UPDATE results SET ProductCategories = ? WHERE ProductURL = ?",
+                ((_categories_json(categories), url) for url, categories in rows),
+            )
+            self.conn.execute("PRAGMA user_version = 1")
+
+    def upsert(self, df):
+        # a new value replaces the stored one, a missing value never erases it
+        updates = ", ".join(f"{column} = COALESCE(excluded.{column}, results.{column})" for column in RESULT_COLUMNS[1:])
+        self.conn.executemany(
+            f"""
+            INSERT INTO results ({", ".join(RESULT_COLUMNS)}) VALUES ({", ".join("?" * len(RESULT_COLUMNS))})
+            ON CONFLICT(ProductURL) DO UPDATE SET {updates}
+            """,
+            _to_rows(df),
+        )
+
+    def upsert_missing(self, df):
+        """
+        Fill the rows that are still missing their ProductTitle, returns the number of rows filled.
+        Rows that were already scraped and urls that are not in the store are left untouched.
+        """
+        updates = ", ".join(f"{column} = COALESCE(NULLIF({column}, ''), ?)" for column in RESULT_COLUMNS[1:])
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(
+                f"UPDATE results SET {updates} WHERE ProductURL = ? AND {MISSING_TITLE}",
+                # the url moves from the first to the last parameter
+                (row[1:] + row[:1] for row in _to_rows(df)),
+            )
+        return self.conn.total_changes - before
+
+    def count_missing(self):
+        return self.conn.execute(f"SELECT COUNT(*) FROM results WHERE {MISSING_TITLE}").fetchone()[0]
+
+    def changed_files(self, paths):
+        # compare size and mtime first, only hash the files that look different
+        changed = []
+        for path in paths:
+            stat = os.stat(path)
+            row = self.conn.execute("SELECT size, mtime, sha1 FROM manifest WHERE path = ?", (path,)).fetchone()
+            if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+                continue
+
+            sha1 = file_hash(path)
+            if row is not None and row[2] == sha1:
+                # touched but identical, just remember the new mtime
+                self.conn.execute("UPDATE manifest SET mtime = ? WHERE path = ?", (stat.st_mtime, path))
+                continue
+            changed.append((path, stat.st_size, stat.st_mtime, sha1))
+        self.conn.commit()
+        return changed
+
+    def ingest(self, paths):
+        """
+        Merge the new or changed result files into the store, returns their paths.
+        """
+        merged = []
+        for path, size, mtime, sha1 in self.changed_files(paths):
+            df = read_results(path)
+            # one transaction per file, so the manifest never lies about a merge
+            with self.conn:
+                self.upsert(df)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?, ?)",
+                    (path, size, mtime, sha1, df.shape[0], datetime.now().isoformat()),
+                )
+            merged.append(path)
+        return merged
+
+    def to_frame(self):
+        # categories come back as lists, like a parquet result file
+        df = pd.read_sql_query(f"SELECT {', '.join(RESULT_COLUMNS)} FROM results", self.conn)
+        df["ProductCategories"] = df["ProductCategories"].map(_categories_list)
+        return df
+
+    def to_csv(self, path):
+        self.to_frame().to_csv(path, index=False)
+
+    def close(self):
+        self.conn.close()
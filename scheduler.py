@@ -0,0 +1,55 @@
+# bounded-concurrency scheduler for async scraping
+# at most `concurrency` pages are in flight at the same time, urls are pulled
+# lazily from any iterable and results are handed over as soon as they finish
+
+import asyncio
+
+
+_DONE = object()
+
+
+async def run_bounded(items, worker, concurrency=4, on_result=None):
+    """
+    Run `worker(item)` for every item with a fixed number of concurrent tasks.
+
+    Parameters:
+        items (iterable): Items to be processed, consumed lazily (can be a generator or an async generator).
+        worker (coroutine function): Called once per item, its return value is the result.
+        concurrency (int): Maximum number of items processed at the same time.
+        on_result (callable): Called with each result as soon as it is ready. If None,
+            the results are collected and returned as a list (in completion order).
+    """
+    results = []
+    if on_result is None:
+        on_result = results.append
+
+    # small buffer so the producer never runs far ahead of the workers
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def producer():
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                await queue.put(item)
+        else:
+            for item in items:
+                await queue.put(item)
+        for _ in range(concurrency):
+            await queue.put(_DONE)
+
+    async def consumer():
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            on_result(await worker(item))
+
+    tasks = [asyncio.ensure_future(producer())]
+    tasks += [asyncio.ensure_future(consumer()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # stop everything if one of the tasks failed
+        for task in tasks:
+            task.cancel()
+
+    return results
@@ -4,16 +4,24 @@
 
 # data wrangling
 import pandas as pd
-import numpy as np
 
 # scraping
 import asyncio  # concurrent processing
 import concurrent
 from concurrent.futures import ProcessPoolExecutor  # multiprocessor processing
 from multiprocessing import cpu_count  # multiprocessor processing
-from arsenic import get_session, browsers, services  # async selenium
+from session_pool import SessionPool  # reusable arsenic sessions
+from scheduler import run_bounded  # bounded concurrency
+from rate_limiter import AdaptiveRateLimiter  # adaptive request rate
+from extractors import DEFAULT_FIELDS, select_fields, extract_raw, build_result, classify  # field registry
+from work_queue import open_queue  # shared work queue
+from url_source import iter_unique_urls  # streamed url deduplication
+from url_utils import UrlDeduper  # one scrape per product
+from result_sink import write_parquet, result_schema  # columnar output
+from metrics import METRICS, span, inc  # per-stage timing
 from datetime import datetime
 import os
+import socket
 
 # logging
 import logging
@@ -26,165 +34,179 @@ from timeit import default_timer as timer
 def set_arsenic_log_level(level=logging.WARNING):
     logger = logging.getLogger("arsenic")
 
-    def logger_factory():
-        return logger
+    def logger_factory(*args):
+        # structlog.get_logger(name) goes to the stdlib logger of that name, ex: "metrics" spans
+        return logging.getLogger(args[0]) if args else logger
 
     structlog.configure(logger_factory=logger_factory)
     logger.setLevel(level)
 
 
 # extract detail for each page
-async def extract_details(page):
-
-    # configure the web driver
-    service = services.Chromedriver()
-    browser = browsers.Chrome()
-    browser.capabilities = {
-        "goog:chromeOptions": {
-            "args": [
-                "--headless",
-                "--disable-gpu",
-                "--no-sandbox",
-                "--disable-dev-shm-usage",
-                "--disable-extensions",
-                "--disable-infobars",
-                "--disable-notifications",
-                "--disable-logging",
-                "--mute-audio",
-            ]
-        }
-    }
-
-    async with get_session(service, browser) as session:
-        data = {
-            "ProductURL": page,
-        }
-
-        # navigate to the web page
+async def extract_details(session, page, fields=DEFAULT_FIELDS):
+    # navigate to the web page
+    with span("navigate"):
         await session.get(page)
-        # print(page)
-
-        # get the title of the current page
-        document_title = await session.execute_script("return document.title;")
-
-        # skip scraping process if page not found, ex: https://www.amazon.com/dp/B004N5KULM
-        if document_title == "Page Not Found":
-            data["ProductTitle"] = document_title
-            return data
-
-        # extract the text content of the page
-        ## TITLE
-        try:
-            title_el = await session.get_element("#productTitle")
-            title_text = await title_el.get_text()
-        except:
-            title_text = ""
-
-        ## BYLINE INFO
-        try:
-            byline_el = await session.get_element("#bylineInfo")
-            byline_text = await byline_el.get_text()
-        except:
-            byline_text = ""
-
-        ## BRAND
-        """
-        try:
-            table_el = await session.get_element("table")
-            table_text = await table_el.get_text()
-            brand_text = table_text.split('Brand ')[1].split('\n')[0]
-        except:
-            brand_text = ""
-        """
-
-        ## DESCRIPTION
-        """
-        try:
-            description_el = await session.get_element("#productDescription")
-            description_text = await description_el.get_text()
-        except:
-            # not all product have description
-            description_text = ""
-        """
-
-        ## FIRST IMAGE
-        """
-        try:
-            img_el = await session.get_element("#imgTagWrapperId")
-            img_el_img = await img_el.get_element("img")
-            img_src = await img_el_img.get_attribute("src")
-        except:
-            img_src = ""
-        """
-
-        ## CATEGORIES
+    # print(page)
+
+    # extract the text content of the page in a single round trip
+    with span("extract"):
+        raw = await extract_raw(session, fields)
+    return build_result(page, raw, fields)
+
+
+# claim urls from the shared queue, one small batch at a time
+# an empty claim doesn't end the run while urls are still leased: a page that fails
+# late goes back to pending, so the worker polls (with a backoff) until nothing is left
+# the queue calls block on sqlite locks, they run in a thread to keep the pages in flight going
+async def iter_claimed(queue, worker_id, batch_size, poll_every=1.0, max_poll_every=10.0):
+    delay = poll_every
+    while True:
+        batch = await asyncio.to_thread(queue.claim, worker_id, batch_size)
+        if batch:
+            delay = poll_every
+            for page in batch:
+                yield page
+            continue
+
+        counts = await asyncio.to_thread(queue.counts)
+        if not counts.get("pending") and not counts.get("leased"):
+            return
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_poll_every)
+
+
+# function to loop the pages and write the results back to the queue
+async def extract_details_task(queue, worker_id, concurrency, batch_size, initial_rate=1.0, max_rate=5.0, browser_profile="default", fields=DEFAULT_FIELDS):
+    # bounded number of browsers per core, each reused for many pages
+    pool = SessionPool(size=concurrency, headless=True, profile=browser_profile)
+
+    # request rate shared by the sessions of this core
+    limiter = AdaptiveRateLimiter(rate=initial_rate, max_rate=max_rate)
+
+    async def scrape(page):
+        await limiter.acquire()
+        start = timer()
         try:
-            cat_el = await session.get_element(".a-subheader")
-            cat_text = await cat_el.get_text()
-            cat_text_list = cat_text.split("\n")[::2]
-        except:
-            # not all product have categories, ex: https://www.amazon.com/dp/B001EO5TPM
-            cat_text_list = ""
-
-        data["ProductTitle"] = title_text
-        data["ProductBylineInfo"] = byline_text
-        # data["ProductBrandFromTable"] = brand_text
-        # data["ProductDesc"] = description_text
-        # data["ProductImg"] = img_src
-        data["ProductCategories"] = cat_text_list
-
+            async with pool.session() as session:
+                data = await extract_details(session, page, fields)
+        except Exception as e:
+            # keep the url so it shows up as missing and can be scraped again
+            print(e)
+            data = {"ProductURL": page}
+        limiter.record(classify(data), timer() - start)
+
+        with span("write"):
+            await asyncio.to_thread(queue.finish, data)
         return data
 
+    def collect(data):
+        inc("pages_total", outcome=classify(data))
 
-# function to loop the pages and gather the results
-async def extract_details_task(pages_for_task):
-    tasks = [extract_details(page) for page in pages_for_task]
-    list_of_lists = await asyncio.gather(*tasks)
-    return list_of_lists
+    # failed pages go back to the queue and are retried by any worker
+    pages = iter_claimed(queue, worker_id, batch_size)
+    async with pool:
+        await run_bounded(pages, scrape, concurrency, on_result=collect)
+    print(worker_id, limiter.metrics())
 
 
 # wrapper to run the scraping for each core
-def asyncio_wrapper(pages_for_task):
-    return asyncio.run(extract_details_task(pages_for_task))
-
-
-def main(idx_range, num_cores=1):
+def asyncio_wrapper(queue_spec, worker_id, concurrency, batch_size, initial_rate=1.0, max_rate=5.0, metrics_port=None, browser_profile="default", fields=DEFAULT_FIELDS, metrics_dir=None):
+    # per-stage timing of this core, served to prometheus and summarized at the end
+    if metrics_port is not None:
+        METRICS.serve(metrics_port)
+
+    queue = open_queue(queue_spec)
+    try:
+        asyncio.run(extract_details_task(queue, worker_id, concurrency, batch_size, initial_rate, max_rate, browser_profile, fields))
+    finally:
+        queue.close()
+        if metrics_dir is not None:
+            METRICS.write_summary(os.path.join(metrics_dir, f"{worker_id}.json"))
+
+
+def run_workers(queue_spec, num_cores=1, concurrency=4, batch_size=20, initial_rate=1.0, max_rate=5.0, metrics_port=None, browser_profile="default", fields=DEFAULT_FIELDS, metrics_dir=None):
+    """
+    Pull urls from the queue with `num_cores` processes until it is empty.
+    Other machines can call this with the same (redis) queue to help out.
+    With `metrics_port`, core i serves its prometheus metrics on port metrics_port + i.
+    With `metrics_dir`, every core writes its json summary there as <worker_id>.json.
+    """
+    host = socket.gethostname()
+    with ProcessPoolExecutor(max_workers=num_cores) as executor:
+        tasks = [
+            executor.submit(
+                asyncio_wrapper, queue_spec, f"{host}-{os.getpid()}-{i}", concurrency, batch_size, initial_rate, max_rate,
+                metrics_port + i if metrics_port is not None else None, browser_profile, fields, metrics_dir,
+            )
+            for i in range(num_cores)
+        ]
+
+        # wait for every core, raising the error of a crashed one
+        concurrent.futures.wait(tasks)
+        for task in tasks:
+            task.result()
+
+
+def iter_output_records(results, products, deduper):
+    # results fanned out to every original url, then an empty row for every url without a result,
+    # the rows of the csv output without building a dataframe
+    done = set()
+    for result in results:
+        done.add(result["ProductURL"])
+        yield from deduper.fan_out(result)
+    for product in products:
+        if product not in done:
+            yield from deduper.fan_out({"ProductURL": product})
+
+
+def main(idx_range, num_cores=1, concurrency=4, batch_size=20, queue_spec=None, output_format="csv", initial_rate=1.0, max_rate=5.0, metrics_port=None, browser_profile="default", fields=DEFAULT_FIELDS):
     # suppress log from arsenic
     set_arsenic_log_level()
 
-    # list of pages to be scraped
-    pages = pd.read_csv("Reviews_withURL.csv", usecols=["ProductURL"])["ProductURL"].unique()
-    pages = pages[idx_range[0] : idx_range[1]]
-
-    start = timer()
+    # columns of the results, only these are read from the pages
+    fields = select_fields(fields)
 
-    # split the scraping task into several cores, based on num_cores
-    executor = ProcessPoolExecutor(max_workers=num_cores)
-    tasks = [
-        executor.submit(asyncio_wrapper, pages_for_task)
-        for pages_for_task in np.array_split(pages, num_cores)
-    ]
+    # list of pages to be scraped, only the requested range of distinct urls is kept in memory
+    pages = list(iter_unique_urls("Reviews_withURL.csv", idx_range))
 
-    # combine the scraping results from different cores
-    doneTasks, _ = concurrent.futures.wait(tasks)
-    results = [item.result() for item in doneTasks]
-    flattened_results = sum(results, [])
+    # every product is scraped once, whatever the form of its urls, and its result fanned back out to every url
+    deduper = UrlDeduper()
+    products = list(deduper.unique(pages))
 
-    # convert result list to dataframe
-    df = pd.DataFrame(flattened_results)
-
-    # multiprocessing mess up the row order, so the following code will reorder the urls
-    df = df.set_index("ProductURL").reindex(pages).reset_index()
+    start = timer()
 
-    # save to csv
     FOLDER_NAME = "results"
     if not os.path.exists(FOLDER_NAME):
         os.makedirs(FOLDER_NAME)
 
+    # shared work queue instead of fixed chunks per core
+    # rerunning the same range resumes it, finished urls are not claimed again
+    if queue_spec is None:
+        queue_spec = os.path.join(FOLDER_NAME, "queue", f"from_{idx_range[0]}_to_{idx_range[1]}.sqlite")
+    queue = open_queue(queue_spec)
+    queue.put(products)
+
+    run_workers(queue_spec, num_cores, concurrency, batch_size, initial_rate, max_rate, metrics_port, browser_profile, fields, os.path.join(FOLDER_NAME, "metrics"))
+    print(queue.counts())
+
+    # save to csv, or parquet with the categories as a native list column
     now = datetime.now()
     datetime_string = now.strftime("%Y%m%d_%H%M%S")
-    filename = f"{FOLDER_NAME}/{datetime_string}_from_{idx_range[0]}_to_{idx_range[1]}_scrap_results.csv"
-    df.to_csv(filename, index=False)
+    filename = f"{FOLDER_NAME}/{datetime_string}_from_{idx_range[0]}_to_{idx_range[1]}_scrap_results"
+    if output_format == "parquet":
+        # streamed from the queue, rows in queue order
+        write_parquet(iter_output_records(queue.results(), products, deduper), f"{filename}.parquet", schema=result_schema(fields))
+    else:
+        # convert queue results to dataframe
+        df = pd.DataFrame(list(deduper.fan_out_records(queue.results())))
+        if df.empty:
+            df = pd.DataFrame(columns=["ProductURL"])
+
+        # multiprocessing mess up the row order, so the following code will reorder the urls
+        df = df.set_index("ProductURL").reindex(pages).reset_index()
+        df.to_csv(f"{filename}.csv", index=False)
+    queue.close()
 
     end = timer()
     print(end - start)
@@ -195,4 +217,6 @@ if __name__ == "__main__":
     idx_range = (0, 500)
     num_cores = 3
     # num_cores = cpu_count() - 1
-    main(idx_range, num_cores)
+    concurrency = 4  # pages in flight per core
+    # queue_spec = "redis://localhost:6379/0"  # share the queue with other machines
+    main(idx_range, num_cores, concurrency)
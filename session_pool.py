@@ -0,0 +1,242 @@
+# pool of long-lived chrome sessions
+# launching chromedriver + chrome costs more than loading one product page,
+# so every session is reused for many urls and only recycled after
+# `max_pages` pages or after an error
+# every launched browser gets its own disposable profile folder, removed in the
+# background when the browser is retired
+
+import asyncio
+import random
+from contextlib import asynccontextmanager
+
+from arsenic import start_session, stop_session, browsers, services  # async selenium
+
+from metrics import span  # per-stage timing
+from profile_dirs import ProfileDirs  # disposable chrome profiles
+
+# measure computation time
+from timeit import default_timer as timer
+
+
+CHROME_ARGS = [
+    "--disable-gpu",
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-extensions",
+    "--disable-infobars",
+    "--disable-notifications",
+    "--disable-logging",
+    "--mute-audio",
+]
+
+# "lean" profile: nothing we extract needs images, media, web fonts or ad / tracking requests
+# stylesheets are kept, innerText depends on which elements are displayed
+LEAN_ARGS = [
+    "--blink-settings=imagesEnabled=false",
+    "--disable-remote-fonts",
+]
+
+LEAN_PREFS = {
+    "profile.managed_default_content_settings.images": 2,
+    "profile.default_content_setting_values.notifications": 2,
+    "profile.default_content_setting_values.media_stream": 2,
+    "profile.default_content_setting_values.geolocation": 2,
+}
+
+# blocked through the devtools protocol, for what the preferences don't cover
+LEAN_BLOCKED_URLS = [
+    "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*.mp4", "*.webm", "*.m3u8",
+    "*amazon-adsystem.com*", "*doubleclick.net*", "*googlesyndication.com*",
+    "*fls-na.amazon.com*", "*unagi.amazon.com*",
+]
+
+PROFILES = ("default", "lean")
+
+
+def build_browser(headless=True, user_agent_string=None, profile="default", user_data_dir=None):
+    browser = browsers.Chrome()
+    browser.capabilities = {
+        "goog:chromeOptions": {
+            "args": list(CHROME_ARGS),
+        }
+    }
+
+    if profile == "lean":
+        browser.capabilities['goog:chromeOptions']['args'].extend(LEAN_ARGS)
+        browser.capabilities['goog:chromeOptions']['prefs'] = dict(LEAN_PREFS)
+        # session.get returns once the DOM is ready, without waiting for every subresource
+        browser.capabilities['pageLoadStrategy'] = "eager"
+
+    if headless:
+        browser.capabilities['goog:chromeOptions']['args'].append("--headless")
+
+    if user_agent_string:
+        browser.capabilities['goog:chromeOptions']['args'].append(f"user-agent={user_agent_string}")
+
+    if user_data_dir:
+        # otherwise chromedriver leaves a scoped_dir* profile in the temp folder for every browser
+        browser.capabilities['goog:chromeOptions']['args'].append(f"--user-data-dir={user_data_dir}")
+
+    return browser
+
+
+async def apply_profile(session, profile="default"):
+    # request blocking has to be set on the running browser, through chromedriver's cdp endpoint
+    if profile != "lean":
+        return
+    await session.request("/goog/cdp/execute", "POST", {"cmd": "Network.enable", "params": {}})
+    await session.request("/goog/cdp/execute", "POST", {"cmd": "Network.setBlockedURLs", "params": {"urls": LEAN_BLOCKED_URLS}})
+
+
+class PooledSession:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.session = None
+        self.user_data_dir = None
+
+        # pages handled by the current browser, reset on recycle
+        self.pages_since_launch = 0
+        self.launched_at = None
+
+        # statistics for the whole run
+        self.pages = 0
+        self.launches = 0
+        self.errors = 0
+        self.launch_time = 0.0
+        self.scrape_time = 0.0
+
+
+class SessionPool:
+    """
+    Fixed set of arsenic sessions shared by the scraping loop.
+
+    Parameters:
+        size (int): Number of sessions (browsers) kept alive at the same time.
+        headless (bool): If True, the browser UI won't pop up during the scraping process.
+        user_agent_list (list): If given, every launched browser picks a random user agent from it.
+        max_pages (int): Number of pages a session handles before it is recycled.
+        profile (str): "default", or "lean" to skip images, media, fonts and ad / tracking requests
+            and to return from navigation as soon as the DOM is ready.
+        profile_dirs (ProfileDirs): Where the browser profiles are created, defaults to ProfileDirs().
+            Over its `max_bytes`, the oldest session is recycled early, one at a time.
+    """
+
+    def __init__(self, size=1, headless=True, user_agent_list=None, max_pages=100, profile="default", profile_dirs=None):
+        if profile not in PROFILES:
+            raise ValueError(f"unknown browser profile {profile!r}, expected one of {PROFILES}")
+        self.size = size
+        self.headless = headless
+        self.user_agent_list = user_agent_list
+        self.max_pages = max_pages
+        self.profile = profile
+        self.profile_dirs = profile_dirs if profile_dirs is not None else ProfileDirs()
+        self.slots = [PooledSession(session_id) for session_id in range(size)]
+        self._idle = None
+
+    async def __aenter__(self):
+        # the queue is created here so it belongs to the running event loop
+        self._idle = asyncio.Queue()
+        for slot in self.slots:
+            self._idle.put_nowait(slot)
+        # profiles left behind by a crashed run
+        await asyncio.to_thread(self.profile_dirs.sweep)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _launch(self, slot):
+        user_agent_string = None
+        if self.user_agent_list:
+            user_agent_string = random.choice(self.user_agent_list)
+
+        start = timer()
+        slot.user_data_dir = self.profile_dirs.create()
+        try:
+            with span("launch"):
+                try:
+                    slot.session = await start_session(
+                        services.Chromedriver(),
+                        build_browser(self.headless, user_agent_string, self.profile, slot.user_data_dir),
+                    )
+                except BaseException:
+                    self._release_profile(slot)
+                    raise
+                try:
+                    await apply_profile(slot.session, self.profile)
+                except BaseException:
+                    # never hand out a browser without its profile
+                    await self._retire(slot)
+                    raise
+        finally:
+            slot.launch_time += timer() - start
+        slot.launches += 1
+        slot.pages_since_launch = 0
+        slot.launched_at = timer()
+
+    def _release_profile(self, slot):
+        user_data_dir, slot.user_data_dir = slot.user_data_dir, None
+        self.profile_dirs.release(user_data_dir)
+
+    async def _retire(self, slot):
+        session, slot.session = slot.session, None
+        if session is None:
+            return
+        try:
+            await stop_session(session)
+        except Exception:
+            # the browser might already be dead, nothing left to clean up
+            pass
+        # chrome has exited, its profile can go
+        self._release_profile(slot)
+
+    @asynccontextmanager
+    async def session(self):
+        # borrow an idle session, launching the browser lazily
+        slot = await self._idle.get()
+        try:
+            if slot.session is None:
+                await self._launch(slot)
+
+            start = timer()
+            try:
+                yield slot.session
+            except BaseException:
+                # a failed page may leave the browser in a bad state
+                slot.errors += 1
+                await self._retire(slot)
+                raise
+            finally:
+                slot.scrape_time += timer() - start
+
+            slot.pages += 1
+            slot.pages_since_launch += 1
+            if slot.pages_since_launch >= self.max_pages or (self.profile_dirs.over_cap() and slot is self._oldest()):
+                await self._retire(slot)
+        finally:
+            self._idle.put_nowait(slot)
+
+    def _oldest(self):
+        # over the disk cap, the browser running for the longest time goes first (it has the largest profile)
+        running = [slot for slot in self.slots if slot.session is not None]
+        return min(running, key=lambda slot: slot.launched_at) if running else None
+
+    async def close(self):
+        for slot in self.slots:
+            await self._retire(slot)
+        await self.profile_dirs.wait()
+
+    def report(self):
+        return [
+            {
+                "SessionID": slot.session_id,
+                "Pages": slot.pages,
+                "Launches": slot.launches,
+                "Errors": slot.errors,
+                "LaunchTime": round(slot.launch_time, 2),
+                "ScrapeTime": round(slot.scrape_time, 2),
+            }
+            for slot in self.slots
+        ]
@@ -0,0 +1,128 @@
+# persistent registry of every product url and its scraping status
+# the next urls to scrape (never tried, failed, or scraped too long ago) come
+# from an indexed query instead of rescanning the review and result csv files
+
+import os
+import sqlite3
+import time
+from itertools import islice
+
+from extractors import classify
+from url_utils import extract_asin
+
+
+def _status(result):
+    # (url, status, error) of a scraped page, from the result dict
+    if result.get("ProductTitle") != result.get("ProductTitle"):
+        # NaN title read from a results file, the page was not scraped
+        result = {"ProductURL": result["ProductURL"]}
+    outcome = classify(result)
+    if outcome == "ok":
+        return result["ProductURL"], "done", None
+    if outcome == "not_found":
+        return result["ProductURL"], "not_found", None
+    return result["ProductURL"], "failed", outcome
+
+
+class UrlRegistry:
+    """
+    SQLite registry of product urls with ProductURL as primary key.
+
+    Parameters:
+        path (str): Path of the sqlite file, created if it doesn't exist.
+    """
+
+    def __init__(self, path="results/url_registry.sqlite"):
+        self.path = path
+
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS urls (
+                ProductURL TEXT PRIMARY KEY,
+                asin TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS urls_status_updated_at ON urls (status, updated_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS urls_asin ON urls (asin)")
+        self.conn.commit()
+
+    def register(self, urls, batch_size=10000):
+        # already known urls keep their status, returns the number of new urls
+        # committed batch by batch, so scrapers can start on the first urls of a long stream
+        urls = iter(urls)
+        before = self.conn.total_changes
+        while True:
+            batch = list(islice(urls, batch_size))
+            if not batch:
+                break
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO urls (ProductURL, asin) VALUES (?, ?)",
+                    ((url, extract_asin(url)) for url in batch),
+                )
+        return self.conn.total_changes - before
+
+    def mark(self, url, status, error=None):
+        self.mark_many([(url, status, error)])
+
+    def mark_many(self, updates, only_pending=False):
+        # (url, status, error) tuples, in a single transaction
+        # every registered url of the same ASIN shares the status, a product is scraped once
+        # with only_pending, urls that already have a status are left untouched
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                f"""
+                UPDATE urls SET status = ?, attempts = attempts + 1, last_error = ?, updated_at = ?
+                WHERE (ProductURL = ? OR asin = ?){" AND status = 'pending'" if only_pending else ""}
+                """,
+                ((status, error, now, url, extract_asin(url)) for url, status, error in updates),
+            )
+
+    def record(self, result):
+        self.mark(*_status(result))
+
+    def import_results(self, df):
+        # status of urls scraped before the registry existed, from a results dataframe
+        # only urls still pending are updated, importing the same file again never undoes a later scrape
+        self.register(df["ProductURL"])
+        self.mark_many((_status(result) for result in df.to_dict("records")), only_pending=True)
+
+    def next_batch(self, limit=None, max_attempts=3, stale_after=None):
+        """
+        Urls to scrape next, in registration order.
+
+        Parameters:
+            limit (int): Maximum number of urls. If None, every url to scrape is returned.
+            max_attempts (int): Failed urls are retried until they reach this number of attempts.
+            stale_after (float): If given, scraped urls older than this number of seconds are scraped again.
+        """
+        stale_before = time.time() - stale_after if stale_after is not None else -1
+        rows = self.conn.execute(
+            """
+            SELECT ProductURL FROM urls
+            WHERE status = 'pending'
+               OR (status = 'failed' AND attempts < ?)
+               OR (status IN ('done', 'not_found') AND updated_at < ?)
+            ORDER BY rowid LIMIT ?
+            """,
+            (max_attempts, stale_before, -1 if limit is None else limit),
+        )
+        return [row[0] for row in rows]
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM urls GROUP BY status").fetchall())
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,82 @@
+# stream product urls from csv files without loading the whole file
+
+from hashlib import blake2b
+
+import numpy as np
+import pandas as pd
+
+
+def iter_urls(filename, idx_range=None, column="ProductURL", chunksize=10000):
+    """
+    Yield the urls of `column` in file order, chunk by chunk.
+
+    Parameters:
+        filename (str): Name of the CSV file containing the urls.
+        idx_range (tuple): Start and end index (end index not included) of the rows to yield.
+            If None, every row is yielded.
+        column (str): Name of the column holding the urls.
+        chunksize (int): Number of rows read from the CSV file at once.
+    """
+    start, end = idx_range if idx_range is not None else (0, None)
+
+    offset = 0
+    for chunk in pd.read_csv(filename, usecols=[column], chunksize=chunksize):
+        chunk_start = offset
+        offset += chunk.shape[0]
+
+        if offset <= start:
+            continue
+        if end is not None and chunk_start >= end:
+            break
+
+        lo = max(start - chunk_start, 0)
+        hi = None if end is None else end - chunk_start
+        yield from chunk[column].iloc[lo:hi]
+
+
+def _url_keys(urls):
+    # 8 bytes of hash per url instead of the whole url, collisions are negligible at this scale
+    digests = b"".join(blake2b(url.encode("utf-8"), digest_size=8).digest() for url in urls)
+    return np.frombuffer(digests, dtype="<u8")
+
+
+def _contains(sorted_keys, keys):
+    # membership of every key in a sorted array, by binary search
+    if not len(sorted_keys):
+        return np.zeros(len(keys), dtype=bool)
+    found = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[found] == keys
+
+
+def iter_unique_urls(filename, idx_range=None, column="ProductURL", chunksize=100000):
+    """
+    Yield the distinct urls of `column` in order of first appearance, chunk by chunk.
+    Only an 8-byte hash of every url seen so far is kept in memory, in a sorted numpy array
+    (8 bytes per distinct url, twice that for a moment when a chunk is merged in).
+
+    Parameters:
+        filename (str): Name of the CSV file containing the urls, ex: the review dump.
+        idx_range (tuple): Start and end index (end index not included) of the distinct urls to yield.
+            If None, every distinct url is yielded.
+        column (str): Name of the column holding the urls.
+        chunksize (int): Number of rows read from the CSV file at once.
+    """
+    start, end = idx_range if idx_range is not None else (0, None)
+
+    seen = np.empty(0, dtype="<u8")
+    position = 0
+    for chunk in pd.read_csv(filename, usecols=[column], chunksize=chunksize):
+        # duplicates inside a chunk are dropped by pandas, the sorted hashes handle the rest
+        urls = chunk[column].dropna().drop_duplicates().to_numpy()
+        keys = _url_keys(urls)
+        new = ~_contains(seen, keys)
+
+        for url in urls[new]:
+            if end is not None and position >= end:
+                return
+            if position >= start:
+                yield url
+            position += 1
+
+        # both parts are sorted runs, the stable sort merges them
+        seen = np.sort(np.concatenate([seen, keys[new]]), kind="stable")
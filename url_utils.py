@@ -0,0 +1,62 @@
+# helpers to identify amazon product urls
+
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+
+ASIN_PATTERN = re.compile(r"/(?:dp|gp/product|product-reviews)/([A-Z0-9]{10})(?:[/?#]|$)", re.IGNORECASE)
+
+
+def extract_asin(url):
+    # ex: https://www.amazon.com/dp/B001E4KFG0 -> B001E4KFG0
+    match = ASIN_PATTERN.search(url)
+    return match.group(1).upper() if match else None
+
+
+def normalize_url(url):
+    # lowercase scheme and host, drop query string, fragment and trailing slash
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, "", ""))
+
+
+def canonicalize_url(url):
+    # one url per product: https://www.amazon.com/gp/product/b001e4kfg0/?th=1 -> https://www.amazon.com/dp/B001E4KFG0
+    # scheme and host are kept, so other amazon domains and local mock servers still work
+    asin = extract_asin(url)
+    if asin is None:
+        return normalize_url(url)
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower() or "https", parts.netloc.lower() or "www.amazon.com", f"/dp/{asin}", "", ""))
+
+
+class UrlDeduper:
+    """
+    Scrape every product once: urls are canonicalized, only the first url of every product is
+    scraped, and its result is fanned back out to every original url when the results are written.
+    """
+
+    def __init__(self):
+        # canonical url -> original urls, in order of appearance
+        self.originals = {}
+
+    def unique(self, urls):
+        # lazy, the originals of a product are known once the whole stream is consumed
+        for url in urls:
+            canonical = canonicalize_url(url)
+            originals = self.originals.get(canonical)
+            if originals is None:
+                self.originals[canonical] = [url]
+                yield canonical
+            elif url not in originals:
+                originals.append(url)
+
+    def fan_out(self, result):
+        # one copy of the result per original url of the product
+        url = result.get("ProductURL")
+        return [{**result, "ProductURL": original} for original in self.originals.get(url, [url])]
+
+    def fan_out_records(self, records):
+        # lazy, so records streamed from a journal or a queue stay streamed
+        for result in records:
+            yield from self.fan_out(result)
@@ -0,0 +1,248 @@
+# shared work queue of urls to scrape
+# workers (processes, or machines sharing the queue) pull small batches of urls
+# whenever they are ready, so a slow or captcha-heavy batch never holds up the
+# others. a claimed url is leased: if its worker dies, the url goes back to the
+# queue once the lease expires and is retried up to `max_attempts` times.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from extractors import is_done  # finished pages
+
+
+def open_queue(spec, **kwargs):
+    # "redis://host:port/db" for a redis queue, anything else is a sqlite file
+    if spec.startswith("redis://"):
+        return RedisWorkQueue(spec, **kwargs)
+    return SqliteWorkQueue(spec, **kwargs)
+
+
+class SqliteWorkQueue:
+    """
+    Work queue stored in a sqlite file, safe to share between processes of one host.
+
+    Parameters:
+        path (str): Path of the sqlite file, created if it doesn't exist.
+        lease_seconds (int): Time a worker has to finish a claimed url before it is handed out again.
+        max_attempts (int): Number of times a url is tried before it is marked as failed.
+    """
+
+    def __init__(self, path, lease_seconds=600, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        # autocommit mode, transactions are opened explicitly
+        # workers call the queue from threads (asyncio.to_thread), one call at a time
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                url TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                lease_owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                result TEXT
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS tasks_status_position ON tasks (status, position)")
+
+    def put(self, urls):
+        # already known urls keep their status, so a rerun resumes the queue
+        start = self.conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM tasks").fetchone()[0]
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO tasks (url, position) VALUES (?, ?)",
+            ((url, start + i) for i, url in enumerate(urls)),
+        )
+        self.conn.execute("COMMIT")
+
+    def claim(self, worker_id, n):
+        with self._lock:
+            return self._claim(worker_id, n)
+
+    def _claim(self, worker_id, n):
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # leases of dead workers run out, give up on urls that used all their attempts
+            self.conn.execute(
+                """
+                UPDATE tasks SET status = 'failed', last_error = 'lease expired'
+                WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?
+                """,
+                (now, self.max_attempts),
+            )
+            urls = [
+                row[0]
+                for row in self.conn.execute(
+                    """
+                    SELECT url FROM tasks
+                    WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?)
+                    ORDER BY position LIMIT ?
+                    """,
+                    (now, n),
+                )
+            ]
+            self.conn.executemany(
+                """
+                UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE url = ?
+                """,
+                ((worker_id, now + self.lease_seconds, url) for url in urls),
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return urls
+
+    def complete(self, url, result):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE tasks SET status = 'done', lease_owner = NULL, result = ? WHERE url = ?",
+                (json.dumps(result, ensure_ascii=False), url),
+            )
+
+    def fail(self, url, error):
+        with self._lock:
+            self.conn.execute(
+                """
+                UPDATE tasks
+                SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    lease_owner = NULL, last_error = ?
+                WHERE url = ?
+                """,
+                (self.max_attempts, error, url),
+            )
+
+    def finish(self, result):
+        # complete or retry, depending on the scraped result
+        if is_done(result):
+            self.complete(result["ProductURL"], result)
+        else:
+            self.fail(result["ProductURL"], "scraping failed")
+
+    def counts(self):
+        with self._lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+    def results(self):
+        for (result,) in self.conn.execute("SELECT result FROM tasks WHERE status = 'done' ORDER BY position"):
+            yield json.loads(result)
+
+    def close(self):
+        self.conn.close()
+
+
+class RedisWorkQueue:
+    """
+    Same queue on top of redis, for workers spread over several machines.
+
+    Parameters:
+        url (str): Redis url, ex: "redis://localhost:6379/0".
+        name (str): Prefix of the redis keys used by this queue.
+        lease_seconds (int): Time a worker has to finish a claimed url before it is handed out again.
+        max_attempts (int): Number of times a url is tried before it is marked as failed.
+    """
+
+    def __init__(self, url, name="scrape", lease_seconds=600, max_attempts=3):
+        # optional dependency, only needed for multi-host runs
+        import redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.keys = {
+            key: f"{name}:{key}"
+            for key in ("seen", "pending", "leases", "attempts", "results", "failed")
+        }
+
+    def put(self, urls):
+        urls = list(urls)
+        pipe = self.redis.pipeline()
+        for url in urls:
+            pipe.sadd(self.keys["seen"], url)
+        added = pipe.execute()
+
+        # already known urls keep their status, so a rerun resumes the queue
+        new_urls = [url for url, is_new in zip(urls, added) if is_new]
+        if new_urls:
+            self.redis.rpush(self.keys["pending"], *new_urls)
+
+    def _requeue_expired(self):
+        for url in self.redis.zrangebyscore(self.keys["leases"], "-inf", time.time()):
+            # only the worker that removes the lease requeues the url
+            if not self.redis.zrem(self.keys["leases"], url):
+                continue
+            attempts = int(self.redis.hget(self.keys["attempts"], url) or 0)
+            if attempts >= self.max_attempts:
+                self.redis.hset(self.keys["failed"], url, "lease expired")
+            else:
+                self.redis.rpush(self.keys["pending"], url)
+
+    def claim(self, worker_id, n):
+        self._requeue_expired()
+
+        urls = []
+        for _ in range(n):
+            url = self.redis.lpop(self.keys["pending"])
+            if url is None:
+                break
+            urls.append(url)
+
+        pipe = self.redis.pipeline()
+        for url in urls:
+            pipe.hincrby(self.keys["attempts"], url, 1)
+            pipe.zadd(self.keys["leases"], {url: time.time() + self.lease_seconds})
+        pipe.execute()
+        return urls
+
+    def complete(self, url, result):
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.keys["leases"], url)
+        pipe.hset(self.keys["results"], url, json.dumps(result, ensure_ascii=False))
+        pipe.execute()
+
+    def fail(self, url, error):
+        self.redis.zrem(self.keys["leases"], url)
+        attempts = int(self.redis.hget(self.keys["attempts"], url) or 0)
+        if attempts >= self.max_attempts:
+            self.redis.hset(self.keys["failed"], url, error)
+        else:
+            self.redis.rpush(self.keys["pending"], url)
+
+    def finish(self, result):
+        # complete or retry, depending on the scraped result
+        if is_done(result):
+            self.complete(result["ProductURL"], result)
+        else:
+            self.fail(result["ProductURL"], "scraping failed")
+
+    def counts(self):
+        return {
+            "pending": self.redis.llen(self.keys["pending"]),
+            "leased": self.redis.zcard(self.keys["leases"]),
+            "done": self.redis.hlen(self.keys["results"]),
+            "failed": self.redis.hlen(self.keys["failed"]),
+        }
+
+    def results(self):
+        for result in self.redis.hvals(self.keys["results"]):
+            yield json.loads(result)
+
+    def close(self):
+        self.redis.close()